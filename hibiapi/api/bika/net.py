@@ -7,7 +7,9 @@ from typing import TYPE_CHECKING, Any, Literal, Optional
 from pydantic import BaseModel, Field
 
 from hibiapi.api.bika.constants import BikaConstants
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.credentials import credential_key, credentials
+from hibiapi.utils.metrics import auth_refreshes
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 if TYPE_CHECKING:
     from .api import BikaEndpoints
@@ -47,6 +49,7 @@ class NetRequest(BaseNetClient):
         super().__init__(
             headers=BikaConstants.DEFAULT_HEADERS.copy(),
             proxies=BikaConstants.CONFIG["proxy"].as_dict(),
+            pool=BikaConstants.CONFIG["pool"].get(PoolConfig),
         )
         self.auth_lock = asyncio.Lock()
 
@@ -59,15 +62,36 @@ class NetRequest(BaseNetClient):
 
     async def login(self, endpoint: "BikaEndpoints"):
         login_data = BikaConstants.CONFIG["account"].get(BikaLogin)
-        login_result: dict[str, Any] = await endpoint.request(
-            "auth/sign-in",
-            body=login_data.dict(),
-            no_token=True,
-        )
-        assert login_result["code"] == 200, login_result["message"]
-        if not (
-            isinstance(login_data := login_result.get("data"), dict)
-            and "token" in login_data
-        ):
-            raise ValueError("failed to read Bika account token.")
+        key = credential_key("bika", login_data.email)
+        async with credentials.lock(key):
+            # NOTE: another worker may have logged in while lock was awaited
+            if (token := await credentials.get(key)) is not None:
+                self._token = token
+                if self.token is not None:
+                    auth_refreshes.inc(self.upstream, "shared")
+                    return
+            await self._sign_in(endpoint, login_data)
+            assert self._token is not None
+            _, body = load_jwt(self._token)
+            await credentials.set(
+                key, self._token, body.exp - datetime.now(timezone.utc)
+            )
+
+    async def _sign_in(self, endpoint: "BikaEndpoints", login_data: BikaLogin):
+        try:
+            login_result: dict[str, Any] = await endpoint.request(
+                "auth/sign-in",
+                body=login_data.dict(),
+                no_token=True,
+            )
+            assert login_result["code"] == 200, login_result["message"]
+            if not (
+                isinstance(login_data := login_result.get("data"), dict)
+                and "token" in login_data
+            ):
+                raise ValueError("failed to read Bika account token.")
+        except Exception:
+            auth_refreshes.inc(self.upstream, "failure")
+            raise
+        auth_refreshes.inc(self.upstream, "success")
         self._token = login_data["token"]
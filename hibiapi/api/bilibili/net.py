@@ -1,6 +1,6 @@
 from httpx import Cookies
 
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 from .constants import BilibiliConstants
 
@@ -10,4 +10,5 @@ class NetRequest(BaseNetClient):
         super().__init__(
             headers={"user-agent": BilibiliConstants.USER_AGENT},
             cookies=Cookies({k: v.value for k, v in BilibiliConstants.COOKIES.items()}),
+            pool=BilibiliConstants.CONFIG["pool"].get(PoolConfig),
         )
@@ -1,6 +1,6 @@
 from httpx import Cookies
 
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 from .constants import NeteaseConstants
 
@@ -10,4 +10,5 @@ class NetRequest(BaseNetClient):
         super().__init__(
             headers=NeteaseConstants.DEFAULT_HEADERS,
             cookies=Cookies({k: v.value for k, v in NeteaseConstants.COOKIES.items()}),
+            pool=NeteaseConstants.CONFIG["pool"].get(PoolConfig),
         )
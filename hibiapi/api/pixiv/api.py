@@ -1,15 +1,19 @@
 import json
 import re
+import time
 from datetime import date, timedelta
 from enum import Enum
 from typing import Any, Literal, Optional, Union, cast, overload
 
+from httpx import HTTPStatusError
+
 from hibiapi.api.pixiv.constants import PixivConstants
 from hibiapi.api.pixiv.net import NetRequest as PixivNetClient
 from hibiapi.utils.cache import cache_config
 from hibiapi.utils.decorators import enum_auto_doc
 from hibiapi.utils.net import catch_network_error
 from hibiapi.utils.routing import BaseEndpoint, dont_route, request_headers
+from hibiapi.utils.tracing import span
 
 
 @enum_auto_doc
@@ -160,25 +164,38 @@ class PixivEndpoints(BaseEndpoint):
     ) -> Union[dict[str, Any], str]:
         headers = self.client.headers.copy()
 
-        net_client = cast(PixivNetClient, self.client.net_client)
-        async with net_client.auth_lock:
-            auth, token = net_client.get_available_user()
-            if auth is None:
-                auth = await net_client.auth(token)
-        headers["Authorization"] = f"Bearer {auth.access_token}"
-
         if language := request_headers.get().get("Accept-Language"):
             language = self._parse_accept_language(language)
             headers["Accept-Language"] = language
 
-        response = await self.client.get(
-            self._join(
-                base=PixivConstants.APP_HOST,
-                endpoint=endpoint,
-                params=params or {},
-            ),
-            headers=headers,
-        )
+        net_client = cast(PixivNetClient, self.client.net_client)
+        with span("pixiv.account.wait"):
+            account = await net_client.accounts.acquire()
+        started, throttled = time.perf_counter(), None
+        try:
+            if (auth := net_client.valid_auth(account.token)) is None:
+                try:
+                    with span("pixiv.auth.refresh"):
+                        auth = await net_client.refresh(account.token)
+                except HTTPStatusError:
+                    # NOTE: an account rejected on refresh is unusable as well
+                    throttled = True
+                    raise
+            headers["Authorization"] = f"Bearer {auth.access_token}"
+
+            response = await self.client.get(
+                self._join(
+                    base=PixivConstants.APP_HOST,
+                    endpoint=endpoint,
+                    params=params or {},
+                ),
+                headers=headers,
+            )
+            throttled = response.status_code in net_client.accounts.throttle_status
+        finally:
+            net_client.accounts.release(
+                account, time.perf_counter() - started, throttled
+            )
         if return_text:
             return response.text
         return response.json()
@@ -259,7 +276,7 @@ class PixivEndpoints(BaseEndpoint):
             },
         )
 
-    @cache_config(ttl=timedelta(hours=12))
+    @cache_config(ttl=timedelta(hours=12), hard_ttl=timedelta(days=1))
     async def rank(
         self,
         *,
@@ -349,7 +366,7 @@ class PixivEndpoints(BaseEndpoint):
             },
         )
 
-    @cache_config(ttl=timedelta(hours=12))
+    @cache_config(ttl=timedelta(hours=12), hard_ttl=timedelta(days=1))
     async def tags(self):
         return await self.request("v1/trending-tags/illust")
 
@@ -514,7 +531,7 @@ class PixivEndpoints(BaseEndpoint):
         novel_match = re.search(r"novel:\s+(?P<data>{.+?}),\s+isOwnWork", response)
         return json.loads(novel_match["data"] if novel_match else response)
 
-    @cache_config(ttl=timedelta(hours=12))
+    @cache_config(ttl=timedelta(hours=12), hard_ttl=timedelta(days=1))
     async def tags_novel(self):
         return await self.request("v1/trending-tags/novel")
 
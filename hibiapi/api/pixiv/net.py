@@ -1,13 +1,20 @@
 import asyncio
 import hashlib
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
-from itertools import cycle
+from typing import Optional
 
 from httpx import URL
 from pydantic import BaseModel, Extra, Field
 
+from hibiapi.utils.credentials import credential_key, credentials
+from hibiapi.utils.exceptions import UpstreamAPIException
 from hibiapi.utils.log import logger
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.metrics import auth_refreshes
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 from .constants import PixivConstants
 
@@ -32,28 +39,230 @@ class PixivAuthData(AccountDataModel):
     refresh_token: str
     user: PixivUserData
 
+    @property
+    def expires_at(self) -> datetime:
+        return self.time + timedelta(seconds=self.expires_in)
+
+    @property
+    def valid(self) -> bool:
+        # NOTE: leave a minute for the request to reach Pixiv
+        return self.expires_at - timedelta(minutes=1) > datetime.now()
+
+
+SCHEDULER_RATE = PixivConstants.CONFIG["account"]["scheduler"]["rate"].get(float)
+SCHEDULER_MAX_WAIT = PixivConstants.CONFIG["account"]["scheduler"]["max-wait"].get(
+    float
+)
+SCHEDULER_WINDOW = PixivConstants.CONFIG["account"]["scheduler"]["window"].as_number()
+SCHEDULER_THROTTLE_RATIO = PixivConstants.CONFIG["account"]["scheduler"][
+    "throttle-ratio"
+].get(float)
+SCHEDULER_QUARANTINE = PixivConstants.CONFIG["account"]["scheduler"]["quarantine"].get(
+    float
+)
+
+
+@dataclass
+class PixivAccount:
+    token: str
+    in_flight: int = 0
+    latency: float = 0
+    """Moving average of response time, in seconds"""
+    next_slot: float = 0
+    """Monotonic time at which the next paced request may be sent"""
+    quarantined_until: float = 0
+    throttled: deque[bool] = field(default_factory=deque)
+
+
+class AccountScheduler:
+    """Spread requests over Pixiv accounts by their load and health
+
+    The least loaded account which is not quarantined is picked, requests of
+    each account are paced to `rate` per second, and accounts whose recent
+    responses are mostly throttled are quarantined for a while. Requests
+    which would wait longer than `max_wait` for their slot are rejected.
+    """
+
+    throttle_status = (403, 429)
+    minimum = 5
+    """Requests to observe before an account can be quarantined"""
+
+    def __init__(
+        self,
+        tokens: list[str],
+        *,
+        rate: float = SCHEDULER_RATE,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+        window: int = SCHEDULER_WINDOW,
+        throttle_ratio: float = SCHEDULER_THROTTLE_RATIO,
+        quarantine: float = SCHEDULER_QUARANTINE,
+    ):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.max_wait = max_wait
+        self.throttle_ratio, self.quarantine = throttle_ratio, quarantine
+        self.accounts = [
+            PixivAccount(token, throttled=deque(maxlen=window)) for token in tokens
+        ]
+
+    def pick(self, now: float) -> PixivAccount:
+        if not self.accounts:
+            raise UpstreamAPIException("No Pixiv account available", code=503)
+        # NOTE: when all accounts are quarantined, the one released first is used
+        healthy = [
+            account for account in self.accounts if account.quarantined_until <= now
+        ] or [min(self.accounts, key=lambda account: account.quarantined_until)]
+        return min(
+            healthy,
+            key=lambda account: (
+                max(account.next_slot, now),
+                account.in_flight,
+                account.latency,
+            ),
+        )
+
+    async def acquire(self) -> PixivAccount:
+        now = time.monotonic()
+        account = self.pick(now)
+        start = max(account.next_slot, now)
+        if self.max_wait > 0 and (wait := start - now) > self.max_wait:
+            raise UpstreamAPIException(
+                "Pixiv accounts are busy",
+                code=503,
+                headers={"Retry-After": f"{math.ceil(wait)}"},
+            )
+        account.next_slot = start + self.interval
+        account.in_flight += 1
+        if start > now:
+            try:
+                await asyncio.sleep(start - now)
+            except BaseException:
+                account.in_flight -= 1
+                # NOTE: only the latest reservation can be given back, since
+                # later ones have already been promised the slots after it
+                if account.next_slot == start + self.interval:
+                    account.next_slot = start
+                raise
+        return account
+
+    def release(self, account: PixivAccount, elapsed: float, throttled: Optional[bool]):
+        """Record result of a request, `throttled` is `None` if it is unknown"""
+        account.in_flight -= 1
+        account.latency = (
+            0.8 * account.latency + 0.2 * elapsed if account.latency else elapsed
+        )
+        if throttled is None:
+            return
+        account.throttled.append(throttled)
+        if (
+            len(account.throttled) < self.minimum
+            or sum(account.throttled) / len(account.throttled) < self.throttle_ratio
+        ):
+            return
+        account.throttled.clear()
+        account.quarantined_until = time.monotonic() + self.quarantine
+        logger.warning(
+            f"Pixiv account <y>#{self.accounts.index(account)}</y> is throttled, "
+            f"<r>quarantined</r> for <y>{self.quarantine:.0f}s</y>"
+        )
+
 
 class NetRequest(BaseNetClient):
+    refresh_ahead = timedelta(
+        seconds=PixivConstants.CONFIG["account"]["refresh-ahead"].as_number()
+    )
+    refresh_retry = timedelta(seconds=30)
+
     def __init__(self, tokens: list[str]):
         super().__init__(
             headers=PixivConstants.DEFAULT_HEADERS.copy(),
             proxies=PixivConstants.CONFIG["proxy"].as_dict(),
+            pool=PixivConstants.CONFIG["pool"].get(PoolConfig),
         )
-        self.user_tokens = cycle(tokens)
-        self.auth_lock = asyncio.Lock()
+        self.accounts = AccountScheduler(tokens)
         self.user_tokens_dict: dict[str, PixivAuthData] = {}
+        self.refreshing: dict[str, asyncio.Task[PixivAuthData]] = {}
+        self.scheduled: dict[str, asyncio.TimerHandle] = {}
         self.headers["accept-language"] = PixivConstants.CONFIG["language"].as_str()
 
-    def get_available_user(self):
-        token = next(self.user_tokens)
-        if (auth_data := self.user_tokens_dict.get(token)) and (
-            auth_data.time + timedelta(minutes=1, seconds=auth_data.expires_in)
-            > datetime.now()
-        ):
-            return auth_data, token
-        return None, token
+    def valid_auth(self, refresh_token: str) -> Optional[PixivAuthData]:
+        """Access token of the account if it is still valid
+
+        Tokens are replaced as a whole by refreshes, so reading them needs no
+        lock.
+        """
+        if (auth_data := self.user_tokens_dict.get(refresh_token)) and auth_data.valid:
+            return auth_data
+        return None
 
-    async def auth(self, refresh_token: str):
+    def _start_refresh(self, refresh_token: str) -> asyncio.Task[PixivAuthData]:
+        if (task := self.refreshing.get(refresh_token)) is None:
+            task = self.refreshing[refresh_token] = asyncio.create_task(
+                self.auth(refresh_token)
+            )
+            task.add_done_callback(lambda _: self.refreshing.pop(refresh_token, None))
+        return task
+
+    async def refresh(self, refresh_token: str) -> PixivAuthData:
+        """Refresh the access token, joining the refresh already in progress"""
+        # NOTE: a cancelled request must not cancel the refresh others share
+        return await asyncio.shield(self._start_refresh(refresh_token))
+
+    def _schedule_refresh(self, refresh_token: str, delay: timedelta):
+        if (handle := self.scheduled.pop(refresh_token, None)) is not None:
+            handle.cancel()
+        self.scheduled[refresh_token] = asyncio.get_running_loop().call_later(
+            max(delay.total_seconds(), 0), self._background_refresh, refresh_token
+        )
+
+    def _background_refresh(self, refresh_token: str):
+        self.scheduled.pop(refresh_token, None)
+        task = self._start_refresh(refresh_token)
+        task.add_done_callback(
+            lambda _: self._background_refreshed(refresh_token, task)
+        )
+
+    def _background_refreshed(
+        self, refresh_token: str, task: asyncio.Task[PixivAuthData]
+    ):
+        if task.cancelled() or (e := task.exception()) is None:
+            return
+        logger.warning(
+            f"Pixiv token background refresh <r>failed</r>: {e!r}, "
+            f"retry in <y>{self.refresh_retry.total_seconds():.0f}s</y>"
+        )
+        auth_data = self.user_tokens_dict.get(refresh_token)
+        if auth_data is not None and auth_data.valid:
+            self._schedule_refresh(refresh_token, self.refresh_retry)
+
+    async def auth(self, refresh_token: str) -> PixivAuthData:
+        """Get a new access token, reusing one stored by another worker"""
+        key = credential_key("pixiv", refresh_token)
+        async with credentials.lock(key):
+            # NOTE: another worker may have refreshed it while lock was awaited
+            if (stored := await credentials.get(key)) is not None and (
+                (auth_data := PixivAuthData.parse_raw(stored)).expires_at
+                - self.refresh_ahead
+                > datetime.now()
+            ):
+                auth_refreshes.inc(self.upstream, "shared")
+            else:
+                auth_data = await self._request_token(refresh_token)
+                await credentials.set(
+                    key, auth_data.json(), auth_data.expires_at - datetime.now()
+                )
+
+        self.user_tokens_dict[refresh_token] = auth_data
+        self._schedule_refresh(
+            refresh_token, auth_data.expires_at - self.refresh_ahead - datetime.now()
+        )
+        user_data = auth_data.user
+        logger.opt(colors=True).info(
+            f"Pixiv account <m>{user_data.id}</m> info <b>Updated</b>: "
+            f"<b><e>{user_data.name}</e>({user_data.account})</b>."
+        )
+        return auth_data
+
+    async def _request_token(self, refresh_token: str) -> PixivAuthData:
         url = URL(PixivConstants.AUTH_HOST).join("/auth/token")
         time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
         headers = {
@@ -71,15 +280,12 @@ class NetRequest(BaseNetClient):
             "refresh_token": refresh_token,
         }
 
-        async with self as client:
-            response = await client.post(url, data=payload, headers=headers)
-            response.raise_for_status()
-
-        self.user_tokens_dict[refresh_token] = PixivAuthData.parse_obj(response.json())
-        user_data = self.user_tokens_dict[refresh_token].user
-        logger.opt(colors=True).info(
-            f"Pixiv account <m>{user_data.id}</m> info <b>Updated</b>: "
-            f"<b><e>{user_data.name}</e>({user_data.account})</b>."
-        )
-
-        return self.user_tokens_dict[refresh_token]
+        try:
+            async with self as client:
+                response = await client.post(url, data=payload, headers=headers)
+                response.raise_for_status()
+        except Exception:
+            auth_refreshes.inc(self.upstream, "failure")
+            raise
+        auth_refreshes.inc(self.upstream, "success")
+        return PixivAuthData.parse_obj(response.json())
@@ -1,4 +1,4 @@
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 from .constants import SauceConstants
 
@@ -8,4 +8,5 @@ class NetRequest(BaseNetClient):
         super().__init__(
             headers={"user-agent": SauceConstants.USER_AGENT},
             proxies=SauceConstants.PROXIES,
+            pool=SauceConstants.CONFIG["pool"].get(PoolConfig),
         )
@@ -1,5 +1,8 @@
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.net import BaseNetClient, PoolConfig
+
+from .api import Config
 
 
 class NetRequest(BaseNetClient):
-    pass
+    def __init__(self):
+        super().__init__(pool=Config["pool"].get(PoolConfig))
@@ -77,7 +77,7 @@ class WallpaperEndpoint(BaseEndpoint):
         return response.json()
 
     # 壁纸有防盗链token, 不建议长时间缓存
-    @cache_config(ttl=timedelta(hours=2))
+    @cache_config(ttl=timedelta(hours=2), hard_ttl=timedelta(hours=3))
     async def wallpaper(
         self,
         *,
@@ -101,7 +101,7 @@ class WallpaperEndpoint(BaseEndpoint):
         )
 
     # 壁纸有防盗链token, 不建议长时间缓存
-    @cache_config(ttl=timedelta(hours=2))
+    @cache_config(ttl=timedelta(hours=2), hard_ttl=timedelta(hours=3))
     async def vertical(
         self,
         *,
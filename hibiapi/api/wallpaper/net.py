@@ -1,8 +1,11 @@
-from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.net import BaseNetClient, PoolConfig
 
 from .constants import WallpaperConstants
 
 
 class NetRequest(BaseNetClient):
     def __init__(self):
-        super().__init__(headers={"user-agent": WallpaperConstants.USER_AGENT})
+        super().__init__(
+            headers={"user-agent": WallpaperConstants.USER_AGENT},
+            pool=WallpaperConstants.CONFIG["pool"].get(PoolConfig),
+        )
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+from fastapi import Query
+from fastapi.responses import PlainTextResponse
+
+from hibiapi.utils.circuit import CircuitStatus
+from hibiapi.utils.decorators.timer import timings
+from hibiapi.utils.net import BaseNetClient
+from hibiapi.utils.profiler import (
+    PROFILING_INTERVAL,
+    PROFILING_MAX_DURATION,
+    StackSampler,
+)
+from hibiapi.utils.routing import SlashRouter
+from hibiapi.utils.tracing import TraceModel, tracer
+from hibiapi.utils.watchdog import BlockingCall, watchdog
+
+router = SlashRouter(tags=["Admin"])
+
+
+@router.get("/circuits", response_model=dict[str, CircuitStatus])
+async def circuits():
+    """Circuit breaker state of every upstream"""
+    return {
+        name: net_client.circuit_breaker.status()
+        for name, net_client in sorted(BaseNetClient.upstreams.items())
+    }
+
+
+@router.get("/timings", response_model=dict[str, dict[str, float]])
+async def function_timings():
+    """Latency percentiles of timed functions, in seconds"""
+    return timings.summary()
+
+
+@router.get("/traces", response_model=list[TraceModel])
+async def traces(limit: int = 20, min_duration: float = 0):
+    """Most recent sampled traces, optionally only slower than `min_duration`"""
+    return tracer.recent(limit, min_duration)
+
+
+@router.get("/blocking", response_model=list[BlockingCall])
+async def blocking_calls():
+    """Stacks captured when the event loop was blocked, latest first"""
+    return [*reversed(watchdog.blocking_calls)]
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=PROFILING_MAX_DURATION),
+    interval: float = Query(PROFILING_INTERVAL, ge=0.001, le=1),
+):
+    """Sample the event loop of this worker, in flamegraph collapsed format"""
+    sampler = StackSampler(threading.get_ident(), interval)
+    await asyncio.to_thread(sampler.run, seconds)
+    return PlainTextResponse(
+        sampler.collapsed(),
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.collapsed"',
+            "X-Profile-Samples": f"{sampler.samples}",
+        },
+    )
@@ -1,4 +1,5 @@
 import asyncio
+import math
 import re
 from contextlib import asynccontextmanager
 from ipaddress import ip_address
@@ -7,20 +8,29 @@ from typing import Annotated
 
 import sentry_sdk
 from fastapi import Depends, FastAPI, Request, Response
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from sentry_sdk.integrations.logging import LoggingIntegration
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from hibiapi import __version__
+from hibiapi.app.admin import router as AdminRouter
 from hibiapi.app.routes import router as ImplRouter
-from hibiapi.utils.cache import cache
+from hibiapi.utils.access import access_logger
+from hibiapi.utils.cache import close_redis_client, tiered_cache
 from hibiapi.utils.config import Config
+from hibiapi.utils.encoding import FastJSONResponse
 from hibiapi.utils.exceptions import ClientSideException, RateLimitReachedException
+from hibiapi.utils.limiter import LIMIT_ENABLED, limiter
 from hibiapi.utils.log import logger
+from hibiapi.utils.metrics import METRICS_ENABLED
+from hibiapi.utils.metrics import registry as metrics_registry
 from hibiapi.utils.net import BaseNetClient
 from hibiapi.utils.temp import TempFile
+from hibiapi.utils.warmup import scheduler as warmup_scheduler
+from hibiapi.utils.watchdog import watchdog
 
 DESCRIPTION = (
     """
@@ -57,6 +67,7 @@ AUTHORIZATION_ENABLED = Config["authorization"]["enabled"].as_bool()
 AUTHORIZATION_ALLOWED = Config["authorization"]["allowed"].get(list[AuthorizationModel])
 
 security = HTTPBasic()
+optional_security = HTTPBasic(auto_error=False)
 
 
 async def basic_authorization_depend(
@@ -76,30 +87,24 @@ async def basic_authorization_depend(
     )
 
 
-RATE_LIMIT_ENABLED = Config["limit"]["enabled"].as_bool()
-RATE_LIMIT_MAX = Config["limit"]["max"].as_number()
-RATE_LIMIT_INTERVAL = Config["limit"]["interval"].as_number()
-
-
 async def rate_limit_depend(request: Request):
     if not request.client:
         return
 
     try:
         client_ip = ip_address(request.client.host)
-        client_ip_hex = client_ip.packed.hex()
-        limit_key = f"rate_limit:IPv{client_ip.version}-{client_ip_hex:x}"
+        identity = f"IPv{client_ip.version}-{client_ip.packed.hex()}"
     except ValueError:
-        limit_key = f"rate_limit:fallback-{request.client.host}"
-
-    request_count = await cache.incr(limit_key)
-    if request_count <= 1:
-        await cache.expire(limit_key, timeout=RATE_LIMIT_INTERVAL)
-    elif request_count > RATE_LIMIT_MAX:
-        limit_remain: int = await cache.get_expire(limit_key)
-        raise RateLimitReachedException(headers={"Retry-After": limit_remain})
+        identity = f"fallback-{request.client.host}"
 
-    return
+    credentials = await optional_security(request) if AUTHORIZATION_ENABLED else None
+    key, limit = limiter.resolve(
+        request.url.path, identity, credentials and credentials.username
+    )
+    if (retry_after := await limiter.acquire(key, limit)) is not None:
+        raise RateLimitReachedException(
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
 
 
 async def flush_sentry():
@@ -124,8 +129,18 @@ async def cleanup_clients():
 
 @asynccontextmanager
 async def fastapi_lifespan(app: FastAPI):
+    await watchdog.start()
+    await tiered_cache.start()
+    await limiter.start()
+    await warmup_scheduler.start()
     yield
-    await asyncio.gather(cleanup_clients(), flush_sentry())
+    await warmup_scheduler.stop()
+    await asyncio.gather(
+        cleanup_clients(), flush_sentry(), tiered_cache.stop(), limiter.stop()
+    )
+    await close_redis_client()
+    await asyncio.to_thread(access_logger.stop)
+    await watchdog.stop()
 
 
 app = FastAPI(
@@ -135,15 +150,22 @@ app = FastAPI(
     docs_url="/docs/test",
     redoc_url="/docs",
     lifespan=fastapi_lifespan,
+    default_response_class=FastJSONResponse,
 )
 app.include_router(
     ImplRouter,
     prefix="/api",
     dependencies=(
         ([Depends(basic_authorization_depend)] if AUTHORIZATION_ENABLED else [])
-        + ([Depends(rate_limit_depend)] if RATE_LIMIT_ENABLED else [])
+        + ([Depends(rate_limit_depend)] if LIMIT_ENABLED else [])
     ),
 )
+if Config["admin"]["enabled"].as_bool():
+    app.include_router(
+        AdminRouter,
+        prefix="/admin",
+        dependencies=[Depends(basic_authorization_depend)],
+    )
 app.mount("/temp", StaticFiles(directory=TempFile.path, check_dir=False))
 
 
@@ -158,13 +180,41 @@ async def robots():
     return Response(content, status_code=200)
 
 
-@app.middleware("http")
-async def redirect_workaround_middleware(request: Request, call_next):
+if METRICS_ENABLED:
+
+    @app.get(
+        "/metrics",
+        include_in_schema=False,
+        dependencies=(
+            [Depends(basic_authorization_depend)]
+            if Config["metrics"]["auth"].as_bool()
+            else []
+        ),
+    )
+    async def metrics():
+        return PlainTextResponse(
+            metrics_registry.render() + "\n",
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+class RedirectWorkaroundMiddleware:
     """Temporary redirection workaround for #12"""
-    if matched := re.match(
-        r"^/(qrcode|pixiv|netease|bilibili)/(\w*)$", request.url.path
-    ):
-        service, path = matched.groups()
-        redirect_url = request.url.replace(path=f"/api/{service}/{path}")
-        return RedirectResponse(redirect_url, status_code=301)
-    return await call_next(request)
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and (
+            matched := re.match(
+                r"^/(qrcode|pixiv|netease|bilibili)/(\w*)$", scope["path"]
+            )
+        ):
+            service, path = matched.groups()
+            redirect_url = Request(scope).url.replace(path=f"/api/{service}/{path}")
+            response = RedirectResponse(redirect_url, status_code=301)
+            return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+app.add_middleware(RedirectWorkaroundMiddleware)
@@ -5,6 +5,7 @@ from pydantic.error_wrappers import ValidationError as PydanticValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from hibiapi.utils import exceptions
+from hibiapi.utils.encoding import encode_json
 from hibiapi.utils.log import logger
 
 from .application import app
@@ -20,7 +21,7 @@ async def exception_handler(
 
     exc.data.url = str(request.url)  # type:ignore
     return Response(
-        content=exc.data.json(),
+        content=encode_json(exc.data.dict()),
         status_code=exc.data.code,
         headers=exc.data.headers,
         media_type="application/json",
@@ -1,28 +1,38 @@
-from collections.abc import Awaitable
-from datetime import datetime
-from typing import Callable
+import threading
+import time
+from secrets import compare_digest
+from typing import Any, Optional
 
-from fastapi import Request, Response
+from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import PlainTextResponse
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 from sentry_sdk.integrations.httpx import HttpxIntegration
-from starlette.datastructures import MutableHeaders
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from hibiapi.utils.access import access_logger
+from hibiapi.utils.compression import (
+    COMPRESSION_ENABLED,
+    COMPRESSION_MINIMUM,
+    COMPRESSORS,
+    STREAM_COMPRESSORS,
+    STREAM_ENCODINGS,
+    compressible,
+    encoded_etag,
+    negotiate,
+)
 from hibiapi.utils.config import Config
 from hibiapi.utils.exceptions import BaseServerException, UncaughtException
-from hibiapi.utils.log import LoguruHandler, logger
+from hibiapi.utils.metrics import route_requests
+from hibiapi.utils.profiler import PROFILING_TOKEN, StackSampler
 from hibiapi.utils.routing import request_headers, response_headers
+from hibiapi.utils.tracing import current_span, tracer
 
 from .application import app
 from .handlers import exception_handler
 
-RequestHandler = Callable[[Request], Awaitable[Response]]
-
-
-if Config["server"]["gzip"].as_bool():
-    app.add_middleware(GZipMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=Config["server"]["cors"]["origins"].get(list[str]),
@@ -39,59 +49,255 @@ app.add_middleware(SentryAsgiMiddleware)
 HttpxIntegration.setup_once()
 
 
-@app.middleware("http")
-async def request_logger(request: Request, call_next: RequestHandler) -> Response:
-    start_time = datetime.now()
-    host, port = request.client or (None, None)
-    response = await call_next(request)
-    process_time = (datetime.now() - start_time).total_seconds() * 1000
-    response_headers.get().setdefault("X-Process-Time", f"{process_time:.3f}")
-    bg, fg = (
-        ("green", "red")
-        if response.status_code < 400
-        else ("yellow", "blue")
-        if response.status_code < 500
-        else ("red", "green")
-    )
-    status_code, method = response.status_code, request.method.upper()
-    user_agent = (
-        LoguruHandler.escape_tag(request.headers["user-agent"])
-        if "user-agent" in request.headers
-        else "<d>Unknown</d>"
-    )
-    logger.info(
-        f"<m><b>{host}</b>:{port}</m>"
-        f" | <{bg.upper()}><b><{fg}>{method}</{fg}></b></{bg.upper()}>"
-        f" | <n><b>{str(request.url)!r}</b></n>"
-        f" | <c>{process_time:.3f}ms</c>"
-        f" | <e>{user_agent}</e>"
-        f" | <b><{bg}>{status_code}</{bg}></b>"
-    )
-    return response
-
-
-@app.middleware("http")
-async def contextvar_setter(request: Request, call_next: RequestHandler):
-    request_headers.set(request.headers)
-    response_headers.set(MutableHeaders())
-    response = await call_next(request)
-    response.headers.update({**response_headers.get()})
-    return response
-
-
-@app.middleware("http")
-async def uncaught_exception_handler(
-    request: Request, call_next: RequestHandler
-) -> Response:
-    try:
-        response = await call_next(request)
-    except Exception as error:
-        response = await exception_handler(
-            request,
-            exc=(
-                error
-                if isinstance(error, BaseServerException)
-                else UncaughtException.with_exception(error)
-            ),
+class RequestLoggerMiddleware:
+    """Log every request and set `X-Process-Time` once response starts"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start_time = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                process_time = (time.perf_counter() - start_time) * 1000
+                response_headers.get().setdefault(
+                    "X-Process-Time", f"{process_time:.3f}"
+                )
+                route, status = self.route_label(scope), message["status"]
+                route_requests.observe(
+                    scope["method"], route, f"{status}", value=process_time / 1000
+                )
+                access_logger.emit(scope, route, status, process_time)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def route_label(scope: Scope) -> str:
+        # NOTE: raw paths are only used when they can not contain parameters,
+        # to keep cardinality of the label bounded
+        if route := scope.get("route"):
+            return route.path
+        if "endpoint" not in scope:
+            return "unmatched"
+        if (app_root_path := scope.get("app_root_path")) is not None:
+            mount = scope["root_path"].removeprefix(app_root_path)
+            return f"{mount}/{{path}}"
+        return "unmatched" if scope.get("path_params") else scope["path"]
+
+
+class CompressionMiddleware:
+    """Compress responses with the coding negotiated from `Accept-Encoding`
+
+    Responses already carrying `Content-Encoding`, such as precompressed
+    cache hits, small responses and binary media types are passed through
+    untouched, and streamed responses are compressed chunk by chunk with a
+    coding supporting it. Strong entity tags of compressed responses are
+    suffixed with the coding, as those of precompressed cache hits are.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM):
+        self.app, self.minimum_size = app, minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = Headers(scope=scope).get("accept-encoding")
+        if (encoding := negotiate(accept_encoding)) is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Message] = None
+        stream: Optional[Any] = None
+
+        async def send_wrapper(message: Message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            elif start is None:
+                if stream is not None and message["type"] == "http.response.body":
+                    body = stream.compress(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        body += stream.flush()
+                    message = {**message, "body": body}
+                return await send(message)
+
+            start_message, start = start, None
+            headers = MutableHeaders(scope=start_message)
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if (
+                "content-encoding" in headers
+                or (not more_body and len(body) < self.minimum_size)
+                or not compressible(headers.get("content-type"))
+            ):
+                await send(start_message)
+                return await send(message)
+
+            if more_body:
+                if (coding := negotiate(accept_encoding, STREAM_ENCODINGS)) is None:
+                    await send(start_message)
+                    return await send(message)
+                stream = STREAM_COMPRESSORS[coding]()
+                body = stream.compress(body)
+                del headers["Content-Length"]
+            else:
+                coding, body = encoding, COMPRESSORS[encoding](body)
+                headers["Content-Length"] = f"{len(body)}"
+            headers["Content-Encoding"] = coding
+            headers.add_vary_header("Accept-Encoding")
+            if etag := headers.get("etag"):
+                headers["ETag"] = encoded_etag(etag, coding)
+            await send(start_message)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class ProfilingMiddleware:
+    """Return sampled stacks instead of response when `X-Profile` matches
+
+    Other requests served concurrently by the worker are sampled as well.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or PROFILING_TOKEN is None
+            or (token := Headers(scope=scope).get("x-profile")) is None
+            or not compare_digest(token.encode(), PROFILING_TOKEN.encode())
+        ):
+            return await self.app(scope, receive, send)
+
+        status = None
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+
+        response = PlainTextResponse(
+            sampler.collapsed(),
+            headers={
+                "X-Profile-Samples": f"{sampler.samples}",
+                "X-Profile-Status": f"{status}",
+            },
         )
-    return response
+        await response(scope, receive, send)
+
+
+class TracingMiddleware:
+    """Start a trace for sampled requests and expose its id in `X-Trace-Id`"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or (
+                root := tracer.start(
+                    f"{scope['method']} {scope['path']}",
+                    method=scope["method"],
+                    path=scope["path"],
+                )
+            )
+            is None
+        ):
+            return await self.app(scope, receive, send)
+
+        response_headers.get().setdefault("X-Trace-Id", root.trace.trace_id)
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+            await send(message)
+
+        token, error = current_span.set(root), None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            tracer.finish(root, error)
+
+
+class ContextVarMiddleware:
+    """Expose request headers to endpoints and apply their response headers"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_headers.set(Headers(scope=scope))
+        response_headers.set(headers := MutableHeaders())
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and headers:
+                MutableHeaders(scope=message).update({**headers})
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class UncaughtExceptionMiddleware:
+    """Convert exceptions escaped from the application into error responses"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        response_started = False
+
+        async def send_wrapper(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as error:
+            # NOTE: nothing can be done once the response has been started
+            if response_started:
+                raise
+            response = await exception_handler(
+                Request(scope),
+                exc=(
+                    error
+                    if isinstance(error, BaseServerException)
+                    else UncaughtException.with_exception(error)
+                ),
+            )
+            await response(scope, receive, send)
+
+
+# NOTE: the last added middleware is the outermost one
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(RequestLoggerMiddleware)
+app.add_middleware(ContextVarMiddleware)
+app.add_middleware(UncaughtExceptionMiddleware)
@@ -11,6 +11,7 @@ from hibiapi.api.bika import (
 )
 from hibiapi.utils.log import logger
 from hibiapi.utils.routing import EndpointRouter
+from hibiapi.utils.warmup import scheduler
 
 try:
     BikaConstants.CONFIG["account"].get(BikaLogin)
@@ -34,3 +35,6 @@ BikaAPIRoot = NetRequest()
 
 
 router.include_endpoint(BikaEndpoints, BikaAPIRoot)
+
+for method in ("categories", "collections", "keywords"):
+    scheduler.register(__config__, BikaEndpoints, BikaAPIRoot, method)
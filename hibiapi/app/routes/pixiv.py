@@ -2,9 +2,16 @@ from typing import Optional
 
 from fastapi import Depends, Header
 
-from hibiapi.api.pixiv import NetRequest, PixivConstants, PixivEndpoints
+from hibiapi.api.pixiv import (
+    NetRequest,
+    PixivConstants,
+    PixivEndpoints,
+    RankingDate,
+    RankingType,
+)
 from hibiapi.utils.log import logger
 from hibiapi.utils.routing import EndpointRouter
+from hibiapi.utils.warmup import scheduler
 
 if not (refresh_tokens := PixivConstants.CONFIG["account"]["token"].as_str_seq()):
     logger.warning("Pixiv API token is not set, pixiv endpoint will be unavailable.")
@@ -24,3 +31,17 @@ __mount__, __config__ = "pixiv", PixivConstants.CONFIG
 
 router = EndpointRouter(tags=["Pixiv"], dependencies=[Depends(accept_language)])
 router.include_endpoint(PixivEndpoints, api_root := NetRequest(refresh_tokens))
+
+scheduler.register(
+    __config__,
+    PixivEndpoints,
+    api_root,
+    "rank",
+    lambda: (
+        {"mode": mode, "date": date}
+        for mode in RankingType
+        for date in (None, RankingDate.yesterday())
+    ),
+)
+scheduler.register(__config__, PixivEndpoints, api_root, "tags")
+scheduler.register(__config__, PixivEndpoints, api_root, "tags_novel")
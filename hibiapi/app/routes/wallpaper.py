@@ -1,7 +1,21 @@
-from hibiapi.api.wallpaper import Config, NetRequest, WallpaperEndpoint
+from hibiapi.api.wallpaper import (
+    Config,
+    NetRequest,
+    WallpaperCategoryType,
+    WallpaperEndpoint,
+)
 from hibiapi.utils.routing import EndpointRouter
+from hibiapi.utils.warmup import scheduler
 
 __mount__, __config__ = "wallpaper", Config
 
 router = EndpointRouter(tags=["Wallpaper"])
-router.include_endpoint(WallpaperEndpoint, NetRequest())
+router.include_endpoint(WallpaperEndpoint, api_root := NetRequest())
+
+scheduler.register(
+    __config__,
+    WallpaperEndpoint,
+    api_root,
+    "wallpaper",
+    lambda: ({"category": category} for category in WallpaperCategoryType),
+)
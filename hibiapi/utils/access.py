@@ -0,0 +1,168 @@
+import json
+import random
+import sys
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from queue import Full, Queue
+from typing import Any, Optional, TextIO
+
+from starlette.requests import Request
+from starlette.types import Scope
+
+from .config import Config
+from .log import LoguruHandler, logger
+from .metrics import Counter
+
+ACCESS_ENABLED = Config["log"]["access"]["enabled"].as_bool()
+ACCESS_FORMAT = Config["log"]["access"]["format"].as_str()
+ACCESS_SAMPLE = Config["log"]["access"]["sample"].get(float)
+ACCESS_QUEUE = Config["log"]["access"]["queue"].as_number()
+ACCESS_FILE = Config["log"]["access"]["file"].get_optional(Path)
+
+access_dropped = Counter(
+    "hibiapi_access_log_dropped_total",
+    "Access log records dropped because the queue is full",
+)
+
+
+@dataclass
+class AccessRecord:
+    time: datetime
+    host: Optional[str]
+    port: Optional[int]
+    method: str
+    url: str
+    route: str
+    status: int
+    process_time: float
+    user_agent: Optional[str]
+
+    @classmethod
+    def from_scope(
+        cls, scope: Scope, route: str, status: int, process_time: float
+    ) -> "AccessRecord":
+        request = Request(scope)
+        host, port = request.client or (None, None)
+        return cls(
+            time=datetime.now(),
+            host=host,
+            port=port,
+            method=request.method.upper(),
+            url=str(request.url),
+            route=route,
+            status=status,
+            process_time=round(process_time, 3),
+            user_agent=request.headers.get("user-agent"),
+        )
+
+    def json(self) -> str:
+        return json.dumps(
+            {**asdict(self), "time": self.time.isoformat()}, ensure_ascii=False
+        )
+
+    def text(self) -> str:
+        bg, fg = (
+            ("green", "red")
+            if self.status < 400
+            else ("yellow", "blue")
+            if self.status < 500
+            else ("red", "green")
+        )
+        user_agent = (
+            LoguruHandler.escape_tag(self.user_agent)
+            if self.user_agent is not None
+            else "<d>Unknown</d>"
+        )
+        return (
+            f"<m><b>{self.host}</b>:{self.port}</m>"
+            f" | <{bg.upper()}><b><{fg}>{self.method}</{fg}></b></{bg.upper()}>"
+            f" | <n><b>{self.url!r}</b></n>"
+            f" | <c>{self.process_time:.3f}ms</c>"
+            f" | <e>{user_agent}</e>"
+            f" | <b><{bg}>{self.status}</{bg}></b>"
+        )
+
+
+class AccessLogger:
+    """Write access logs from a background thread
+
+    The event loop only copies the request scope onto a bounded queue, while
+    building, formatting and writing records happen in a daemon thread.
+    Successful responses are sampled, errors are always kept, and records
+    are dropped and counted when the queue is full.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = ACCESS_ENABLED,
+        format: str = ACCESS_FORMAT,
+        sample: float = ACCESS_SAMPLE,
+        maxsize: int = ACCESS_QUEUE,
+        file: Optional[Path] = ACCESS_FILE,
+    ):
+        assert format in ("text", "json"), f"unknown access log format {format!r}"
+        self.enabled, self.format, self.sample = enabled, format, sample
+        self.file = file
+        self.queue: Queue[Optional[tuple[Any, ...]]] = Queue(maxsize)
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def emit(self, scope: Scope, route: str, status: int, process_time: float):
+        if not self.enabled or (status < 400 and random.random() >= self.sample):
+            return
+        if self.thread is None:
+            self.start()
+        try:
+            # NOTE: scope is copied since the server may reuse it afterwards
+            self.queue.put_nowait((dict(scope), route, status, process_time))
+        except Full:
+            access_dropped.inc()
+
+    def _open(self) -> TextIO:
+        if self.file is None:
+            return sys.stdout
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        return self.file.open("a", encoding="utf-8", buffering=1)
+
+    def _drain(self):
+        output = self._open() if self.format == "json" else None
+        try:
+            while (item := self.queue.get()) is not None:
+                try:
+                    record = AccessRecord.from_scope(*item)
+                    if output is None:
+                        logger.info(record.text())
+                    else:
+                        output.write(record.json() + "\n")
+                except Exception as e:
+                    logger.warning(f"Access log record <r>failed</r>: {e!r}")
+        finally:
+            if output is not None and output is not sys.stdout:
+                output.close()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None or not self.enabled:
+                return
+            self.thread = threading.Thread(
+                target=self._drain, name="access-log", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        """Write out queued records and stop the background thread"""
+        with self.lock:
+            if (thread := self.thread) is None:
+                return
+            self.thread = None
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Full:
+            logger.warning("Access log queue is still full, records may be lost")
+            return
+        thread.join(timeout)
+
+
+access_logger = AccessLogger()
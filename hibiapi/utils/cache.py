@@ -1,17 +1,42 @@
+import asyncio
+import datetime
+import gzip
 import hashlib
+import inspect
+import pickle
+import time
+from collections import Counter, OrderedDict
 from collections.abc import Awaitable
+from dataclasses import dataclass, field
 from datetime import timedelta
-from functools import wraps
+from email.utils import formatdate, parsedate_to_datetime
+from enum import Enum
+from functools import lru_cache, wraps
 from typing import Any, Callable, Optional, TypeVar, cast
+from urllib.parse import urlparse
+from uuid import uuid4
 
 from cashews import Cache
-from pydantic import BaseModel
+from httpx import HTTPError
+from pydantic import BaseConfig, BaseModel
 from pydantic.decorator import ValidatedFunction
+from pydantic.fields import ModelField, Required
+from starlette.datastructures import Headers
+from starlette.responses import Response
 
+from .circuit import CircuitState
+from .compression import ENCODINGS, encoded_etag, negotiate, precompress
 from .config import Config
+from .encoding import decode_json, encode_json
+from .exceptions import UpstreamAPIException
 from .log import logger
+from .metrics import Collected, cache_requests
+from .projection import compile_projector, normalize_fields
+from .tracing import span
 
 CACHE_CONFIG_KEY = "_cache_config"
+CACHE_RAW_KEY = "_cache_raw"
+CACHE_REFRESH_KEY = "_cache_refresh"
 
 AsyncFunc = Callable[..., Awaitable[Any]]
 T_AsyncFunc = TypeVar("T_AsyncFunc", bound=AsyncFunc)
@@ -19,24 +44,61 @@ T_AsyncFunc = TypeVar("T_AsyncFunc", bound=AsyncFunc)
 
 CACHE_ENABLED = Config["cache"]["enabled"].as_bool()
 CACHE_DELTA = timedelta(seconds=Config["cache"]["ttl"].as_number())
+CACHE_GRACE = timedelta(seconds=Config["cache"]["grace"].as_number())
 CACHE_URI = Config["cache"]["uri"].as_str()
 CACHE_CONTROLLABLE = Config["cache"]["controllable"].as_bool()
+CACHE_RAW = Config["cache"]["raw"].as_bool()
+CACHE_COMPRESS = Config["cache"]["compress"].as_bool()
+CACHE_LOCAL_ENABLED = Config["cache"]["local"]["enabled"].as_bool()
+CACHE_LOCAL_SIZE = Config["cache"]["local"]["size"].as_number() * 1024
+CACHE_LOCAL_TTL = Config["cache"]["local"]["ttl"].as_number()
 
 cache = Cache(name="hibiapi")
 try:
     cache.setup(CACHE_URI)
+    CACHE_SHARED = urlparse(CACHE_URI).scheme != "mem"
 except Exception as e:
+    CACHE_SHARED = False
     logger.warning(
         f"Cache URI <y>{CACHE_URI!r}</y> setup <r><b>failed</b></r>: "
         f"<r>{e!r}</r>, use memory backend instead."
     )
 
 
+@lru_cache(maxsize=1)
+def redis_client() -> Optional[Any]:
+    """Redis client of the worker, shared by every user of the cache backend
+
+    `None` unless the cache URI points to Redis.
+    """
+    if urlparse(CACHE_URI).scheme not in ("redis", "rediss"):
+        return None
+    from redis.asyncio import Redis
+
+    # NOTE: query parameters of cache URI are cashews specific options
+    return Redis.from_url(CACHE_URI.partition("?")[0])
+
+
+async def close_redis_client():
+    if redis_client.cache_info().currsize and (client := redis_client()):
+        # NOTE: `aclose` is added in redis 5.0.1, which deprecates `close`
+        close = getattr(client, "aclose", None) or client.close
+        await close()
+    redis_client.cache_clear()
+
+
 class CacheConfig(BaseModel):
     endpoint: AsyncFunc
     namespace: str
     enabled: bool = True
     ttl: timedelta = CACHE_DELTA
+    hard_ttl: timedelta = CACHE_DELTA
+    grace: timedelta = CACHE_GRACE
+    raw: bool = CACHE_RAW
+
+    @property
+    def expire(self) -> timedelta:
+        return self.hard_ttl + self.grace
 
     @staticmethod
     def new(
@@ -44,12 +106,18 @@ class CacheConfig(BaseModel):
         *,
         enabled: bool = True,
         ttl: timedelta = CACHE_DELTA,
+        hard_ttl: Optional[timedelta] = None,
+        grace: timedelta = CACHE_GRACE,
+        raw: bool = CACHE_RAW,
         namespace: Optional[str] = None,
     ):
         return CacheConfig(
             endpoint=function,
             enabled=enabled,
             ttl=ttl,
+            hard_ttl=max(hard_ttl or ttl, ttl),
+            grace=grace,
+            raw=raw,
             namespace=namespace or function.__qualname__,
         )
 
@@ -58,12 +126,32 @@ def cache_config(
     enabled: bool = True,
     ttl: timedelta = CACHE_DELTA,
     namespace: Optional[str] = None,
+    *,
+    hard_ttl: Optional[timedelta] = None,
+    grace: timedelta = CACHE_GRACE,
+    raw: bool = CACHE_RAW,
 ):
+    """Set the cache policy of an endpoint
+
+    The cached value is fresh within `ttl`, served while being revalidated in
+    background until `hard_ttl`, and served when upstream fails within `grace`
+    after `hard_ttl` has passed. With `raw` enabled, the value is stored as
+    encoded JSON bytes which can be sent back without re-serializing.
+    """
+
     def decorator(function: T_AsyncFunc) -> T_AsyncFunc:
         setattr(
             function,
             CACHE_CONFIG_KEY,
-            CacheConfig.new(function, enabled=enabled, ttl=ttl, namespace=namespace),
+            CacheConfig.new(
+                function,
+                enabled=enabled,
+                ttl=ttl,
+                hard_ttl=hard_ttl,
+                grace=grace,
+                raw=raw,
+                namespace=namespace,
+            ),
         )
         return function
 
@@ -73,58 +161,523 @@ def cache_config(
 disable_cache = cache_config(enabled=False)
 
 
-class CachedValidatedFunction(ValidatedFunction):
-    def serialize(self, args: tuple[Any, ...], kwargs: dict[str, Any]) -> BaseModel:
-        values = self.build_values(args=args, kwargs=kwargs)
-        return self.model(**values)
+@dataclass
+class CacheEntry:
+    value: Any
+    time: float = field(default_factory=time.time)
+    encoding: Optional[str] = None
+    """`None` for a Python object, otherwise encoding of the JSON bytes"""
+    variants: dict[str, bytes] = field(default_factory=dict)
+    """Precompressed JSON bytes keyed by content coding, served as they are"""
+    digest: Optional[str] = None
+    """Hash of the JSON bytes, used as strong entity tag"""
+
+    @classmethod
+    def new(cls, value: Any, *, raw: bool = False, compress: bool = CACHE_COMPRESS):
+        content = encode_json(value)
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        if not raw:
+            return cls(value, digest=digest)
+        variants = precompress(content)
+        if compress:
+            gzipped = variants.pop("gzip", None) or gzip.compress(content, mtime=0)
+            return cls(gzipped, encoding="gzip", variants=variants, digest=digest)
+        return cls(content, encoding="identity", variants=variants, digest=digest)
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.time
+
+    @property
+    def content(self) -> bytes:
+        if self.encoding is None:
+            return encode_json(self.value)
+        elif self.encoding == "gzip":
+            return gzip.decompress(self.value)
+        return self.value
+
+    @property
+    def encodings(self) -> tuple[str, ...]:
+        """Content codings this entry can be served with, without compressing"""
+        return tuple(
+            encoding
+            for encoding in ENCODINGS
+            if encoding in self.variants or encoding == self.encoding
+        )
+
+    def load(self) -> Any:
+        return self.value if self.encoding is None else decode_json(self.content)
+
+    def etag(self, encoding: Optional[str] = None) -> Optional[str]:
+        if self.digest is None:
+            return None
+        etag = f'"{self.digest}"'
+        return encoded_etag(etag, encoding) if encoding else etag
+
+    def not_modified(self, request: Headers) -> bool:
+        """Evaluate conditional request headers against this entry"""
+        if (if_none_match := request.get("if-none-match")) is not None:
+            if if_none_match.strip() == "*":
+                return True
+            return self.digest is not None and any(
+                tag.strip().removeprefix("W/").strip('"').partition("-")[0]
+                == self.digest
+                for tag in if_none_match.split(",")
+            )
+        if (if_modified_since := request.get("if-modified-since")) is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.time) <= since
+        return False
+
+    def response(self, request: Optional[Headers] = None) -> Response:
+        """Build response of this entry, negotiated with the request headers"""
+        request = request or Headers()
+        encodings = self.encodings
+        encoding = negotiate(request.get("accept-encoding"), encodings)
+        headers = {"Last-Modified": formatdate(self.time, usegmt=True)}
+        if etag := self.etag(encoding):
+            headers["ETag"] = etag
+        if encodings:
+            headers["Vary"] = "Accept-Encoding"
+
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            content = self.content
+        else:
+            content = (
+                self.value if encoding == self.encoding else self.variants[encoding]
+            )
+            headers["Content-Encoding"] = encoding
+        return Response(content, headers=headers, media_type="application/json")
+
+
+class LocalCache:
+    """Bounded in-process LRU cache, evicting entries by their pickled size"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size, self.ttl, self.size = max_size, ttl, 0
+        self.entries: OrderedDict[str, tuple[CacheEntry, int, float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        if (item := self.entries.get(key)) is None:
+            return None
+        entry, _, expire_at = item
+        if expire_at <= time.time():
+            self.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry, expire: timedelta):
+        self.pop(key)
+        size = len(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_size:
+            return
+        expire_at = min(entry.time + expire.total_seconds(), time.time() + self.ttl)
+        self.entries[key] = (entry, size, expire_at)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.size -= evicted
+
+    def pop(self, key: str):
+        if (item := self.entries.pop(key, None)) is not None:
+            _, size, _ = item
+            self.size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class TwoTierCache:
+    """In-process `LocalCache` tier in front of the configured shared backend
+
+    Workers publish written or deleted keys through Redis pub/sub, so that
+    the local tier of every other worker drops its outdated copy. A broken
+    subscription is restarted with backoff, clearing the local tier since
+    invalidations may have been missed meanwhile.
+    """
+
+    channel = "hibiapi:cache:invalidate"
+    retry_delay, retry_max_delay = 1.0, 60.0
+
+    def __init__(self, backend: Cache, local: Optional[LocalCache] = None):
+        self.backend, self.local = backend, local
+        self.identity = uuid4().hex
+        self.redis: Optional[Any] = None
+        self.listener: Optional[asyncio.Task[None]] = None
+
+    async def get(self, key: str, expire: timedelta) -> Optional[CacheEntry]:
+        if self.local is not None and (entry := self.local.get(key)):
+            return entry
+        if not isinstance(entry := await self.backend.get(key), CacheEntry):
+            return None
+        if self.local is not None:
+            self.local.set(key, entry, expire)
+        return entry
+
+    async def set(self, key: str, entry: CacheEntry, expire: timedelta):
+        await self.backend.set(key, entry, expire=expire)
+        if self.local is not None:
+            self.local.set(key, entry, expire)
+            await self.publish(key)
+
+    async def delete(self, key: str):
+        await self.backend.delete(key)
+        if self.local is not None:
+            self.local.pop(key)
+            await self.publish(key)
+
+    async def publish(self, key: str):
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(self.channel, f"{self.identity}:{key}")
+        except Exception as e:
+            logger.warning(f"Cache invalidation publish <r>failed</r>: {e!r}")
+
+    async def _subscribe(self):
+        assert self.redis is not None and self.local is not None
+        async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+            await pubsub.subscribe(self.channel)
+            # NOTE: invalidations published while disconnected are lost
+            self.local.clear()
+            async for message in pubsub.listen():
+                identity, _, key = message["data"].decode().partition(":")
+                if identity != self.identity:
+                    self.local.pop(key)
+
+    async def _listen(self):
+        delay = self.retry_delay
+        while True:
+            started = time.monotonic()
+            try:
+                await self._subscribe()
+            except Exception as e:
+                logger.warning(
+                    f"Cache invalidation listener <r>stopped</r>: {e!r}, "
+                    f"reconnecting in <y>{delay:.0f}s</y>"
+                )
+            # NOTE: reset backoff once a subscription has lasted for a while
+            if time.monotonic() - started > self.retry_max_delay:
+                delay = self.retry_delay
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.retry_max_delay)
+
+    async def start(self):
+        if self.local is None or (redis := redis_client()) is None:
+            return
+        self.redis = redis
+        self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            await asyncio.gather(self.listener, return_exceptions=True)
+        self.redis = self.listener = None
+        if self.local is not None:
+            self.local.clear()
+
+
+tiered_cache = TwoTierCache(
+    cache,
+    (
+        LocalCache(CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL)
+        if CACHE_SHARED and CACHE_LOCAL_ENABLED
+        else None
+    ),
+)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls sharing a key into one shared execution"""
+
+    def __init__(self):
+        self.flights: dict[str, asyncio.Task[Any]] = {}
+        self.executed: Counter[str] = Counter()
+        self.coalesced: Counter[str] = Counter()
+
+    def start(
+        self,
+        key: str,
+        function: Callable[[], Awaitable[Any]],
+        *,
+        namespace: str,
+    ) -> "asyncio.Task[Any]":
+        if (flight := self.flights.get(key)) is None:
+            self.executed[namespace] += 1
+            flight = self.flights[key] = asyncio.ensure_future(function())
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.coalesced[namespace] += 1
+            logger.debug(f"Request coalesced into flight <b><e>{key}</e></b>")
+        return flight
+
+    async def __call__(
+        self,
+        key: str,
+        function: Callable[[], Awaitable[Any]],
+        *,
+        namespace: str,
+    ) -> Any:
+        # NOTE: shield the shared flight, so that one disconnected client
+        # will not cancel the upstream request other callers are waiting on
+        return await asyncio.shield(self.start(key, function, namespace=namespace))
+
+
+single_flight = SingleFlight()
+
+projections = LocalCache(CACHE_LOCAL_SIZE, CACHE_LOCAL_TTL)
+"""Projected entries keyed by digest of the full entry and normalized fields"""
+
+
+def project_entry(entry: CacheEntry, fields: str, expire: timedelta) -> CacheEntry:
+    """Project `entry` by normalized `fields`, reusing a previous projection
+
+    The projected entry keeps the time of the full one, so that freshness and
+    `Last-Modified` follow it, and gets its own digest for entity tags.
+    """
+    key = f"{entry.digest}:{fields}"
+    if entry.digest is not None and (projected := projections.get(key)):
+        return projected
+    projected = CacheEntry.new(
+        compile_projector(fields)(entry.load()), raw=entry.encoding is not None
+    )
+    projected.time = entry.time
+    if entry.digest is not None:
+        projections.set(key, projected, expire)
+    return projected
+
+
+Collected(
+    "hibiapi_cache_fetches_total",
+    "Upstream fetches executed on cache miss or revalidation",
+    labels=("namespace",),
+    collect=lambda: (((k,), v) for k, v in single_flight.executed.items()),
+    type="counter",
+)
+Collected(
+    "hibiapi_cache_coalesced_total",
+    "Concurrent fetches coalesced into an already running one",
+    labels=("namespace",),
+    collect=lambda: (((k,), v) for k, v in single_flight.coalesced.items()),
+    type="counter",
+)
+
+
+def _log_revalidate_error(key: str):
+    def callback(task: "asyncio.Task[Any]"):
+        if task.cancelled() or (exception := task.exception()) is None:
+            return
+        message = f"Background revalidation of <b><e>{key}</e></b> <r>failed</r>"
+        if isinstance(exception, (UpstreamAPIException, HTTPError)):
+            # NOTE: expected upstream failures, a traceback tells nothing more
+            logger.warning(f"{message}: {exception!r}")
+        else:
+            logger.opt(exception=exception).warning(message)
+
+    return callback
+
+
+def _upstream_closed(args: tuple[Any, ...]) -> bool:
+    """Whether the circuit of endpoint upstream, if any, lets requests pass"""
+    client = getattr(args[0], "client", None) if args else None
+    net_client = getattr(client, "net_client", None)
+    breaker = getattr(net_client, "circuit_breaker", None)
+    return breaker is None or breaker.state is CircuitState.closed
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        return tuple(map(_canonical, value))
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted(map(_canonical, value), key=repr))
+    elif isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    return value
+
+
+class CacheKeyBuilder:
+    """Derive cache keys from call arguments without building a pydantic model
+
+    Arguments are bound to parameter names with defaults filled in, coerced
+    to their annotated types, so that a raw query string such as `"1"` and a
+    validated `1` share the key, then encoded as a sorted tuple of canonical
+    values and hashed by `blake2b`, which, unlike builtin `hash`, is stable
+    across worker processes.
+    """
+
+    def __init__(self, function: AsyncFunc, namespace: str):
+        parameters = [*inspect.signature(function).parameters.values()]
+        if parameters and parameters[0].name == "self":
+            parameters = parameters[1:]
+            self.skip = 1
+        else:
+            self.skip = 0
+        self.namespace, self.names = namespace, [p.name for p in parameters]
+        self.defaults = {
+            p.name: p.default for p in parameters if p.default is not p.empty
+        }
+        self.fields = {
+            p.name: ModelField.infer(
+                name=p.name,
+                value=Required if p.default is p.empty else p.default,
+                annotation=p.annotation,
+                class_validators=None,
+                config=BaseConfig,
+            )
+            for p in parameters
+            if p.annotation is not p.empty and not isinstance(p.annotation, str)
+        }
+
+    def coerce(self, name: str, value: Any) -> Any:
+        if (field := self.fields.get(name)) is None or type(value) is field.type_:
+            return value
+        coerced, errors = field.validate(value, {}, loc=name)
+        # NOTE: invalid arguments are rejected by the endpoint itself
+        return value if errors else coerced
+
+    def __call__(self, args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+        values = {
+            **self.defaults,
+            **dict(zip(self.names, args[self.skip :])),
+            **kwargs,
+        }
+        encoded = repr(
+            tuple(sorted((k, _canonical(self.coerce(k, v))) for k, v in values.items()))
+        )
+        digest = hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+        return f"{self.namespace}:{digest}"
 
 
 def endpoint_cache(function: T_AsyncFunc) -> T_AsyncFunc:
     from .routing import request_headers, response_headers
 
-    vf = CachedValidatedFunction(function, config={})
+    vf = ValidatedFunction(function, config={})
     config = cast(
         CacheConfig,
         getattr(function, CACHE_CONFIG_KEY, None) or CacheConfig.new(function),
     )
+    build_key = CacheKeyBuilder(function, config.namespace)
 
     config.enabled = CACHE_ENABLED and config.enabled
 
-    @wraps(function)
-    async def wrapper(*args, **kwargs):
+    def fetcher(key: str, args: tuple[Any, ...], kwargs: dict[str, Any]):
+        async def fetch():
+            with span("cache.fetch", namespace=config.namespace):
+                entry = CacheEntry.new(await vf.call(*args, **kwargs), raw=config.raw)
+            with span("cache.set", namespace=config.namespace):
+                await tiered_cache.set(key, entry, config.expire)
+            return entry
+
+        return fetch
+
+    async def cached_call(
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        raw: bool,
+        fields: Optional[str] = None,
+    ):
         cache_policy = "public"
+        # NOTE: reject invalid selections before calling upstream
+        fields = fields and normalize_fields(fields)
 
         if CACHE_CONTROLLABLE:
             cache_policy = request_headers.get().get("cache-control", cache_policy)
 
         if not config.enabled or cache_policy.casefold() == "no-store":
-            return await vf.call(*args, **kwargs)
-
-        key = (
-            f"{config.namespace}:"
-            + hashlib.md5(
-                (model := vf.serialize(args=args, kwargs=kwargs))
-                .json(exclude={"self"}, sort_keys=True, ensure_ascii=False)
-                .encode()
-            ).hexdigest()
-        )
+            result = await vf.call(*args, **kwargs)
+            return compile_projector(fields)(result) if fields else result
+
+        with span("cache.key", namespace=config.namespace):
+            key = build_key(args, kwargs)
 
         response_header = response_headers.get()
-        result: Optional[Any] = None
+        entry: Optional[CacheEntry] = None
 
         if cache_policy.casefold() == "no-cache":
-            await cache.delete(key)
-        elif result := await cache.get(key):
+            await tiered_cache.delete(key)
+        else:
+            with span("cache.get", namespace=config.namespace) as get_span:
+                entry = await tiered_cache.get(key, config.expire)
+                if get_span is not None:
+                    get_span.attributes["hit"] = entry is not None
+        if entry is not None:
             logger.debug(f"Request hit cache <b><e>{key}</e></b>")
             response_header.setdefault("X-Cache-Hit", key)
 
-        if result is None:
-            result = await vf.execute(model)
-            await cache.set(key, result, expire=config.ttl)
+        fetch = fetcher(key, args, kwargs)
+
+        if entry is None:
+            status = "miss"
+            entry = await single_flight(key, fetch, namespace=config.namespace)
+        elif (age := entry.age) < config.ttl.total_seconds():
+            status = "fresh"
+        elif age < config.hard_ttl.total_seconds():
+            status = "stale-while-revalidate"
+            # NOTE: revalidation would fail fast while the circuit is open,
+            # the stale entry is served until it expires instead
+            if _upstream_closed(args):
+                single_flight.start(
+                    key, fetch, namespace=config.namespace
+                ).add_done_callback(_log_revalidate_error(key))
+        else:
+            try:
+                entry = await single_flight(key, fetch, namespace=config.namespace)
+                status = "expired"
+            except UpstreamAPIException:
+                logger.warning(f"Serving stale cache <b><e>{key}</e></b> on error")
+                status = "stale-if-error"
+
+        cache_requests.inc(config.namespace, status)
+        response_header.setdefault("X-Cache-Status", status)
+        max_age = config.ttl.total_seconds()
+        if status == "fresh":
+            max_age -= entry.age
+        elif status.startswith("stale"):
+            max_age = 0
+        response_header.setdefault("Cache-Control", f"max-age={max_age:.0f}")
+
+        with span("cache.load", namespace=config.namespace, status=status):
+            if fields:
+                entry = project_entry(entry, fields, config.expire)
+            if not raw:
+                return entry.load()
+            return entry.response(request_headers.get())
+
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        return await cached_call(args, kwargs, raw=False)
+
+    async def raw_wrapper(*args, fields: Optional[str] = None, **kwargs):
+        """Same as `wrapper`, but cached JSON is returned as a built response
 
-        if (cache_remain := await cache.get_expire(key)) > 0:
-            response_header.setdefault("Cache-Control", f"max-age={cache_remain}")
+        With `fields`, the cached value is projected and the projection is
+        cached along with its precompressed variants and entity tag.
+        """
+        return await cached_call(args, kwargs, raw=True, fields=fields)
 
-        return result
+    async def refresh_wrapper(within: timedelta, *args, **kwargs) -> bool:
+        """Refresh the cached value if it will not be fresh after `within`"""
+        if not config.enabled:
+            return False
+        key = build_key(args, kwargs)
+        if (entry := await tiered_cache.get(key, config.expire)) and (
+            entry.age + within.total_seconds() < config.ttl.total_seconds()
+        ):
+            return False
+        await single_flight(key, fetcher(key, args, kwargs), namespace=config.namespace)
+        return True
 
+    setattr(wrapper, CACHE_RAW_KEY, raw_wrapper)
+    setattr(wrapper, CACHE_REFRESH_KEY, refresh_wrapper)
     return wrapper  # type:ignore
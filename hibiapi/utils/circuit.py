@@ -0,0 +1,155 @@
+import time
+from collections import deque
+from datetime import datetime
+from enum import Enum
+from typing import NamedTuple, Optional
+
+from httpx import HTTPError
+from pydantic import BaseModel
+
+from .config import Config
+from .log import logger
+
+CIRCUIT_ENABLED = Config["circuit"]["enabled"].as_bool()
+CIRCUIT_WINDOW = Config["circuit"]["window"].get(float)
+CIRCUIT_MINIMUM = Config["circuit"]["minimum"].as_number()
+CIRCUIT_ERROR_RATIO = Config["circuit"]["error-ratio"].get(float)
+CIRCUIT_SLOW = Config["circuit"]["slow"].get(float)
+CIRCUIT_SLOW_RATIO = Config["circuit"]["slow-ratio"].get(float)
+CIRCUIT_COOLDOWN = Config["circuit"]["cooldown"].get(float)
+CIRCUIT_PROBES = Config["circuit"]["probes"].as_number()
+
+
+class CircuitState(str, Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class CircuitOpenError(HTTPError):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit of upstream {name!r} is open")
+        self.retry_after = retry_after
+
+
+class CircuitStatus(BaseModel):
+    state: CircuitState
+    requests: int
+    errors: int
+    slow: int
+    opened_at: Optional[datetime] = None
+
+
+class CircuitTicket(NamedTuple):
+    """Circuit period a request was acquired in, and whether it is a probe"""
+
+    generation: int
+    probe: bool
+
+
+class CircuitBreaker:
+    """Stop sending requests to an upstream which keeps failing or stalling
+
+    The circuit opens when, within the last `window` seconds and at least
+    `minimum` requests, the ratio of failed or slow requests reaches its
+    threshold. After `cooldown` seconds it turns half-open and lets `probes`
+    requests through, closing again once all of them succeed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        enabled: bool = CIRCUIT_ENABLED,
+        window: float = CIRCUIT_WINDOW,
+        minimum: int = CIRCUIT_MINIMUM,
+        error_ratio: float = CIRCUIT_ERROR_RATIO,
+        slow: float = CIRCUIT_SLOW,
+        slow_ratio: float = CIRCUIT_SLOW_RATIO,
+        cooldown: float = CIRCUIT_COOLDOWN,
+        probes: int = CIRCUIT_PROBES,
+    ):
+        self.name, self.enabled = name, enabled
+        self.window, self.minimum = window, minimum
+        self.error_ratio, self.slow, self.slow_ratio = error_ratio, slow, slow_ratio
+        self.cooldown, self.probes = cooldown, probes
+
+        self.state = CircuitState.closed
+        self.opened_at: Optional[float] = None
+        self.outcomes: deque[tuple[float, bool, bool]] = deque()
+        self.errors, self.slow_requests = 0, 0
+        self.probing, self.probed = 0, 0
+        self.generation = 0
+
+    def _trim(self, now: float):
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            _, failed, slow = self.outcomes.popleft()
+            self.errors -= failed
+            self.slow_requests -= slow
+
+    def _transit(self, state: CircuitState):
+        logger.warning(
+            f"Circuit of upstream <y>{self.name}</y> turned <r>{state.value}</r>"
+        )
+        self.state, self.probing, self.probed = state, 0, 0
+        self.generation += 1
+        self.opened_at = time.time() if state is CircuitState.open else None
+        if state is CircuitState.closed:
+            self.outcomes.clear()
+            self.errors, self.slow_requests = 0, 0
+
+    def acquire(self) -> CircuitTicket:
+        """Check the circuit before sending a request, raise if it is open"""
+        if not self.enabled or self.state is CircuitState.closed:
+            return CircuitTicket(self.generation, False)
+        if self.state is CircuitState.open:
+            assert self.opened_at is not None
+            if (remain := self.opened_at + self.cooldown - time.time()) > 0:
+                raise CircuitOpenError(self.name, remain)
+            self._transit(CircuitState.half_open)
+        if self.probing + self.probed >= self.probes:
+            raise CircuitOpenError(self.name, self.cooldown)
+        self.probing += 1
+        return CircuitTicket(self.generation, True)
+
+    def release(self, ticket: CircuitTicket, failed: Optional[bool], elapsed: float):
+        """Record outcome of a request, `None` for unknown like cancellation
+
+        Outcomes of requests acquired before the last state change are
+        dropped, they neither count as probes nor into the closed window.
+        """
+        if not self.enabled or ticket.generation != self.generation:
+            return
+        if ticket.probe:
+            self.probing -= 1
+            if failed:
+                self._transit(CircuitState.open)
+            elif failed is not None and (probed := self.probed + 1) >= self.probes:
+                self._transit(CircuitState.closed)
+            elif failed is not None:
+                self.probed = probed
+            return
+        if failed is None:
+            return
+
+        now, slow = time.time(), elapsed >= self.slow
+        self._trim(now)
+        self.outcomes.append((now, failed, slow))
+        self.errors += failed
+        self.slow_requests += slow
+
+        if (requests := len(self.outcomes)) >= self.minimum and (
+            self.errors / requests >= self.error_ratio
+            or self.slow_requests / requests >= self.slow_ratio
+        ):
+            self._transit(CircuitState.open)
+
+    def status(self) -> CircuitStatus:
+        self._trim(time.time())
+        return CircuitStatus(
+            state=self.state,
+            requests=len(self.outcomes),
+            errors=self.errors,
+            slow=self.slow_requests,
+            opened_at=self.opened_at and datetime.fromtimestamp(self.opened_at),
+        )
@@ -0,0 +1,129 @@
+import gzip
+import zlib
+from collections.abc import Iterable
+from functools import lru_cache, partial
+from typing import Any, Callable, Optional
+
+from .config import Config
+from .log import logger
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSION_ENABLED = Config["server"]["gzip"].as_bool()
+COMPRESSION_MINIMUM = Config["server"]["compression"]["minimum"].as_number()
+
+Compressor = Callable[[bytes], bytes]
+
+COMPRESSORS: dict[str, Compressor] = {
+    "gzip": partial(gzip.compress, compresslevel=6, mtime=0),
+}
+DECOMPRESSORS: dict[str, Compressor] = {"gzip": gzip.decompress}
+STREAM_COMPRESSORS: dict[str, Callable[[], Any]] = {
+    "gzip": lambda: zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16),
+}
+"""Factories of `zlib` style objects compressing a body chunk by chunk"""
+
+if brotli is not None:
+    COMPRESSORS["br"] = partial(brotli.compress, quality=4)
+    DECOMPRESSORS["br"] = brotli.decompress
+if zstandard is not None:
+    COMPRESSORS["zstd"] = zstandard.ZstdCompressor(level=3).compress
+    DECOMPRESSORS["zstd"] = zstandard.ZstdDecompressor().decompress
+
+
+def _enabled_encodings() -> tuple[str, ...]:
+    if not COMPRESSION_ENABLED:
+        return ()
+    configured = Config["server"]["compression"]["encodings"].get(Optional[list[str]])
+    if configured is None:
+        # NOTE: codings whose optional dependency is missing are skipped
+        return tuple(
+            encoding for encoding in ("zstd", "br", "gzip") if encoding in COMPRESSORS
+        )
+    encodings: list[str] = []
+    for encoding in configured:
+        if encoding not in COMPRESSORS:
+            logger.warning(
+                f"Compression <y>{encoding}</y> is unavailable, "
+                "install <b>hibiapi[compression]</b> to enable it."
+            )
+            continue
+        encodings.append(encoding)
+    return tuple(encodings)
+
+
+ENCODINGS = _enabled_encodings()
+"""Enabled content codings, in server preference order"""
+STREAM_ENCODINGS = tuple(e for e in ENCODINGS if e in STREAM_COMPRESSORS)
+"""Enabled content codings which can compress streamed responses"""
+
+
+@lru_cache(maxsize=256)
+def _parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    qualities: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *params = (item.strip() for item in part.split(";"))
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    return qualities
+
+
+def negotiate(
+    accept_encoding: Optional[str], available: Iterable[str] = ENCODINGS
+) -> Optional[str]:
+    """Pick the content coding preferred by client, ties broken by `available`"""
+    if not accept_encoding:
+        return None
+    qualities = _parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    chosen, best = None, 0.0
+    for encoding in available:
+        if (quality := qualities.get(encoding, wildcard)) > best:
+            chosen, best = encoding, quality
+    return chosen
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    media_type = content_type.partition(";")[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type.endswith(("+json", "+xml"))
+        or media_type
+        in ("application/json", "application/javascript", "application/xml")
+    )
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Entity tag of the representation compressed with `encoding`
+
+    Strong tags must differ between content codings of the same body, weak
+    ones are kept since they only claim semantic equivalence.
+    """
+    if etag.startswith("W/") or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def precompress(content: bytes) -> dict[str, bytes]:
+    """Compress `content` with every enabled coding, if it is large enough"""
+    if len(content) < COMPRESSION_MINIMUM:
+        return {}
+    return {encoding: COMPRESSORS[encoding](content) for encoding in ENCODINGS}
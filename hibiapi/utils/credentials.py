@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+from .cache import CACHE_SHARED, cache
+from .config import Config
+from .log import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+CREDENTIALS_ENABLED = Config["credentials"]["enabled"].as_bool()
+CREDENTIALS_FILE = Config["credentials"]["file"].get(Path)
+CREDENTIALS_FILE = Config["data"]["path"].get(Path) / CREDENTIALS_FILE
+CREDENTIALS_LOCK_TIMEOUT = Config["credentials"]["lock-timeout"].get(float)
+
+
+def credential_key(namespace: str, secret: str) -> str:
+    """Key of a credential, which does not reveal the secret it is derived from"""
+    return f"{namespace}:{hashlib.sha256(secret.encode()).hexdigest()[:16]}"
+
+
+class CredentialStore:
+    """Share upstream credentials between workers and across restarts
+
+    Credentials live in the cache backend when it is shared between workers,
+    otherwise in a local JSON file guarded by file locks. Refreshes are
+    elected with a lock per credential, so one worker refreshes while others
+    wait and then read its result instead of logging in again.
+    """
+
+    prefix = "credentials"
+
+    def __init__(
+        self,
+        enabled: bool = CREDENTIALS_ENABLED,
+        file: Path = CREDENTIALS_FILE,
+        shared: bool = CACHE_SHARED,
+        lock_timeout: float = CREDENTIALS_LOCK_TIMEOUT,
+    ):
+        self.enabled, self.file, self.shared = enabled, file, shared
+        self.lock_timeout = lock_timeout
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            if self.shared:
+                return await cache.get(f"{self.prefix}:{key}")
+            item = (await asyncio.to_thread(self._read)).get(key)
+        except Exception as e:
+            logger.warning(f"Credential <y>{key}</y> read <r>failed</r>: {e!r}")
+            return None
+        if item is None or item["expires"] <= time.time():
+            return None
+        return item["value"]
+
+    async def set(self, key: str, value: str, expire: timedelta):
+        if not self.enabled or expire.total_seconds() <= 0:
+            return
+        expires = time.time() + expire.total_seconds()
+        try:
+            if self.shared:
+                await cache.set(f"{self.prefix}:{key}", value, expire=expire)
+            else:
+                await asyncio.to_thread(self._write, key, value, expires)
+        except Exception as e:
+            logger.warning(f"Credential <y>{key}</y> write <r>failed</r>: {e!r}")
+
+    @asynccontextmanager
+    async def lock(self, key: str) -> AsyncIterator[None]:
+        """Hold the refresh lock of a credential, waiting up to `lock_timeout`
+
+        The lock expires after `lock_timeout` as well, so a crashed worker
+        can not block the refresh forever.
+        """
+        if not self.enabled:
+            yield
+        elif self.shared:
+            async with cache.lock(
+                f"{self.prefix}:lock:{key}",
+                expire=self.lock_timeout,
+                check_interval=0.1,
+            ):
+                yield
+        else:
+            descriptor = await self._file_lock(key)
+            try:
+                yield
+            finally:
+                if descriptor is not None:
+                    os.close(descriptor)
+
+    async def _file_lock(self, key: str) -> Optional[int]:
+        if fcntl is None:
+            return None
+        path = self.file.with_name(f"{self.file.name}.{key.replace(':', '-')}.lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return descriptor
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(0.1)
+        os.close(descriptor)
+        logger.warning(
+            f"Credential lock <y>{key}</y> is still held after "
+            f"<y>{self.lock_timeout:.0f}s</y>, refreshing without it"
+        )
+        return None
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with self.file.open("r", encoding="utf-8") as file:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_SH)
+                return json.loads(file.read() or "{}")
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Credential file <y>{self.file}</y> is corrupted: {e!r}")
+            return {}
+
+    def _write(self, key: str, value: str, expires: float):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        descriptor = os.open(self.file, os.O_RDWR | os.O_CREAT, 0o600)
+        with open(descriptor, "r+", encoding="utf-8") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                items: dict[str, Any] = json.loads(file.read() or "{}")
+            except ValueError:
+                items = {}
+            now = time.time()
+            items = {k: v for k, v in items.items() if v["expires"] > now}
+            items[key] = {"value": value, "expires": expires}
+            file.seek(0)
+            file.truncate()
+            json.dump(items, file)
+
+
+credentials = CredentialStore()
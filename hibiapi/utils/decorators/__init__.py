@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import random
 from asyncio import sleep as async_sleep
 from collections.abc import Awaitable, Iterable
 from functools import partial, wraps
@@ -18,6 +19,39 @@ Argument_T = ParamSpec("Argument_T")
 Return_T = TypeVar("Return_T")
 
 
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of calls
+
+    Every call deposits `ratio` tokens up to `capacity`, and every retry
+    withdraws one, so that retries can not exceed `ratio` of calls except
+    for an initial burst of `capacity`.
+    """
+
+    def __init__(self, ratio: float = 0.1, capacity: float = 10):
+        self.ratio, self.capacity = ratio, capacity
+        self.tokens = capacity
+        self.retries, self.exhausted = 0, 0
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+BudgetGetter = Callable[..., "RetryBudget | None"]
+
+
+def backoff_delay(retried: int, delay: float, backoff: float, max_delay: float):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_delay, delay * backoff**retried))
+
+
 class RetryT(Protocol):
     @overload
     def __call__(self, function: Callable_T) -> Callable_T: ...
@@ -28,7 +62,10 @@ class RetryT(Protocol):
         *,
         retries: int = ...,
         delay: float = ...,
+        backoff: float = ...,
+        max_delay: float = ...,
         exceptions: Iterable[type[Exception]] | None = ...,
+        budget: BudgetGetter | None = ...,
     ) -> RetryT: ...
 
     def __call__(
@@ -37,7 +74,10 @@ class RetryT(Protocol):
         *,
         retries: int = ...,
         delay: float = ...,
+        backoff: float = ...,
+        max_delay: float = ...,
         exceptions: Iterable[type[Exception]] | None = ...,
+        budget: BudgetGetter | None = ...,
     ) -> Callable | RetryT: ...
 
 
@@ -50,7 +90,10 @@ def Retry(
     *,
     retries: int = ...,
     delay: float = ...,
+    backoff: float = ...,
+    max_delay: float = ...,
     exceptions: Iterable[type[Exception]] | None = ...,
+    budget: BudgetGetter | None = ...,
 ) -> RetryT: ...
 
 
@@ -59,55 +102,72 @@ def Retry(
     *,
     retries: int = 3,
     delay: float = 0.1,
+    backoff: float = 2,
+    max_delay: float = 5,
     exceptions: Iterable[type[Exception]] | None = None,
+    budget: BudgetGetter | None = None,
 ) -> Callable | RetryT:
+    """Retry the function on allowed exceptions
+
+    The wait before each retry grows exponentially from `delay` with full
+    jitter. An exception with a `retry_after` attribute sets the least wait,
+    and is raised at once if it exceeds `max_delay`. `budget` is called with
+    the function arguments to get a `RetryBudget` every retry must withdraw.
+    """
     if function is None:
         return partial(
             Retry,
             retries=retries,
             delay=delay,
+            backoff=backoff,
+            max_delay=max_delay,
             exceptions=exceptions,
+            budget=budget,
         )
 
     timed_func = TimeIt(function)
     allowed_exceptions: tuple[type[Exception], ...] = tuple(exceptions or [Exception])
-    assert (retries >= 1) and (delay >= 0)
+    assert (retries >= 1) and (delay >= 0) and (backoff >= 1)
+
+    def next_delay(
+        exception: Exception, retried: int, retry_budget: RetryBudget | None
+    ) -> float:
+        if not isinstance(exception, allowed_exceptions) or retried + 1 >= retries:
+            raise exception
+        wait = backoff_delay(retried, delay, backoff, max_delay)
+        if (retry_after := getattr(exception, "retry_after", None)) is not None:
+            if retry_after > max_delay:
+                raise exception
+            wait = max(wait, retry_after)
+        if retry_budget is not None and not retry_budget.withdraw():
+            raise exception
+        logger.opt().debug(
+            f"Retry of {timed_func=} trigged "
+            f"due to {exception=} raised ({retried=}/{retries=}, {wait=:.3f})"
+        )
+        return wait
 
     @wraps(timed_func)
     def sync_wrapper(*args, **kwargs):
-        error: Exception | None = None
+        if (retry_budget := budget and budget(*args, **kwargs)) is not None:
+            retry_budget.deposit()
         for retried in range(retries):
             try:
                 return timed_func(*args, **kwargs)
             except Exception as exception:
-                error = exception
-                if not isinstance(exception, allowed_exceptions):
-                    raise
-                logger.opt().debug(
-                    f"Retry of {timed_func=} trigged "
-                    f"due to {exception=} raised ({retried=}/{retries=})"
-                )
-                sync_sleep(delay)
-        assert isinstance(error, Exception)
-        raise error
+                sync_sleep(next_delay(exception, retried, retry_budget))
+        raise AssertionError("unreachable")
 
     @wraps(timed_func)
     async def async_wrapper(*args, **kwargs):
-        error: Exception | None = None
+        if (retry_budget := budget and budget(*args, **kwargs)) is not None:
+            retry_budget.deposit()
         for retried in range(retries):
             try:
                 return await timed_func(*args, **kwargs)
             except Exception as exception:
-                error = exception
-                if not isinstance(exception, allowed_exceptions):
-                    raise
-                logger.opt().debug(
-                    f"Retry of {timed_func=} trigged "
-                    f"due to {exception=} raised ({retried=}/{retries})"
-                )
-                await async_sleep(delay)
-        assert isinstance(error, Exception)
-        raise error
+                await async_sleep(next_delay(exception, retried, retry_budget))
+        raise AssertionError("unreachable")
 
     return async_wrapper if iscoroutinefunction(function) else sync_wrapper
 
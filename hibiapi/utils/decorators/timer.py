@@ -1,95 +1,139 @@
 from __future__ import annotations
 
 import time
-from dataclasses import dataclass, field
+from bisect import bisect_left
+from collections.abc import Iterable
 from functools import wraps
 from inspect import iscoroutinefunction
-from typing import Any, Callable, ClassVar, TypeVar
+from typing import Any, Callable, TypeVar
 
-from hibiapi.utils.log import logger
+from hibiapi.utils.config import Config
+from hibiapi.utils.log import level_enabled, logger
+from hibiapi.utils.metrics import Metric, Sample
 
 Callable_T = TypeVar("Callable_T", bound=Callable)
 
+TIMING_ENABLED = Config["timing"]["enabled"].as_bool()
+
+# NOTE: bounds grow by sqrt(2) from 10us to about 84s, so that a percentile
+# read from buckets is at most ~41% above the real value
+TIMING_BUCKETS = tuple(1e-5 * 2 ** (exponent / 2) for exponent in range(47))
+
+
+class TimingHistogram:
+    """Latency histogram of one function over preallocated buckets"""
+
+    __slots__ = ("name", "counts", "count", "total", "max")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * (len(TIMING_BUCKETS) + 1)
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(TIMING_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        """Upper bound of the bucket where `percent` of calls finished"""
+        if not self.count:
+            return 0.0
+        rank, cumulative = percent / 100 * self.count, 0
+        for bound, count in zip(TIMING_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class TimingRegistry(Metric):
+    """Per-function latency histograms shared by timing decorators
+
+    When timing is disabled and TRACE logging is off, `timed` returns the
+    function itself so that decorated functions have no overhead at all.
+    """
+
+    type = "histogram"
+
+    def __init__(self, enabled: bool = TIMING_ENABLED, *, register: bool = True):
+        super().__init__(
+            "hibiapi_function_seconds",
+            "Latency of functions timed by TimeIt",
+            labels=("function",),
+            register=register,
+        )
+        self.enabled = enabled
+        self.histograms: dict[str, TimingHistogram] = {}
+
+    def histogram(self, name: str) -> TimingHistogram:
+        if (histogram := self.histograms.get(name)) is None:
+            histogram = self.histograms[name] = TimingHistogram(name)
+        return histogram
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {
+            name: histogram.summary()
+            for name, histogram in sorted(self.histograms.items())
+        }
+
+    def samples(self) -> Iterable[Sample]:
+        for name, histogram in self.histograms.items():
+            labels, cumulative = {"function": name}, 0
+            for bound, count in zip((*TIMING_BUCKETS, "+Inf"), histogram.counts):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:.6g}"
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_count", labels, histogram.count
+            yield f"{self.name}_sum", labels, histogram.total
+
+    def timed(self, function: Callable_T) -> Callable_T:
+        trace = level_enabled("TRACE")
+        if not (self.enabled or trace):
+            return function
+
+        histogram = self.histogram(f"{function.__module__}.{function.__qualname__}")
+        observe = histogram.observe if self.enabled else None
+        kind = "Async" if iscoroutinefunction(function) else "sync"
+        message = f"<g>{kind}</g> function <y>{function.__qualname__}</y> cost "
+
+        def record(started: float):
+            elapsed = time.perf_counter() - started
+            if observe is not None:
+                observe(elapsed)
+            if trace:
+                logger.trace(message + f"<e>{elapsed * 1000:.3f}ms</e>")
 
-class TimerError(Exception):
-    """A custom exception used to report errors in use of Timer class"""
-
-
-@dataclass
-class Timer:
-    """Time your code using a class, context manager, or decorator"""
-
-    timers: ClassVar[dict[str, float]] = dict()
-    name: str | None = None
-    text: str = "Elapsed time: {:0.3f} seconds"
-    logger_func: Callable[[str], None] | None = print
-    _start_time: float | None = field(default=None, init=False, repr=False)
-
-    def __post_init__(self) -> None:
-        """Initialization: add timer to dict of timers"""
-        if self.name:
-            self.timers.setdefault(self.name, 0)
-
-    def start(self) -> None:
-        """Start a new timer"""
-        if self._start_time is not None:
-            raise TimerError("Timer is running. Use .stop() to stop it")
-
-        self._start_time = time.perf_counter()
-
-    def stop(self) -> float:
-        """Stop the timer, and report the elapsed time"""
-        if self._start_time is None:
-            raise TimerError("Timer is not running. Use .start() to start it")
-
-        # Calculate elapsed time
-        elapsed_time = time.perf_counter() - self._start_time
-        self._start_time = None
-
-        # Report elapsed time
-        if self.logger_func:
-            self.logger_func(self.text.format(elapsed_time * 1000))
-        if self.name:
-            self.timers[self.name] += elapsed_time
-
-        return elapsed_time
-
-    def __enter__(self) -> Timer:
-        """Start a new timer as a context manager"""
-        self.start()
-        return self
-
-    def __exit__(self, *exc_info: Any) -> None:
-        """Stop the context manager timer"""
-        self.stop()
-
-    def _recreate_cm(self) -> Timer:
-        return self.__class__(self.name, self.text, self.logger_func)
-
-    def __call__(self, function: Callable_T) -> Callable_T:
         @wraps(function)
         async def async_wrapper(*args: Any, **kwargs: Any):
-            self.text = (
-                f"<g>Async</g> function <y>{function.__qualname__}</y> "
-                "cost <e>{:.3f}ms</e>"
-            )
-
-            with self._recreate_cm():
+            started = time.perf_counter()
+            try:
                 return await function(*args, **kwargs)
+            finally:
+                record(started)
 
         @wraps(function)
         def sync_wrapper(*args: Any, **kwargs: Any):
-            self.text = (
-                f"<g>sync</g> function <y>{function.__qualname__}</y> "
-                "cost <e>{:.3f}ms</e>"
-            )
-
-            with self._recreate_cm():
+            started = time.perf_counter()
+            try:
                 return function(*args, **kwargs)
+            finally:
+                record(started)
 
-        return (
-            async_wrapper if iscoroutinefunction(function) else sync_wrapper
-        )  # type:ignore
+        return async_wrapper if iscoroutinefunction(function) else sync_wrapper  # type:ignore
 
 
-TimeIt = Timer(logger_func=logger.trace)
+timings = TimingRegistry()
+TimeIt = timings.timed
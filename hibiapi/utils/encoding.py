@@ -0,0 +1,50 @@
+import json
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from .tracing import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def encode_json_compatible(value: Any) -> bytes:
+    # NOTE: keep the same output as `fastapi.responses.JSONResponse`
+    return json.dumps(
+        jsonable_encoder(value),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode()
+
+
+def encode_json(value: Any) -> bytes:
+    """Encode `value` to JSON, with `orjson` if it is installed
+
+    Types unknown to `orjson`, such as pydantic models, are converted by
+    `jsonable_encoder` on demand, and values it refuses, such as integers
+    beyond 64 bits, fall back to the standard library encoder.
+    """
+    if orjson is None:
+        return encode_json_compatible(value)
+    try:
+        return orjson.dumps(
+            value, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS
+        )
+    except orjson.JSONEncodeError:
+        return encode_json_compatible(value)
+
+
+def decode_json(content: bytes) -> Any:
+    return json.loads(content) if orjson is None else orjson.loads(content)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with span("response.render"):
+            return encode_json(content)
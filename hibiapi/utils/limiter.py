@@ -0,0 +1,195 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from .cache import CACHE_SHARED, cache, redis_client
+from .config import Config
+from .log import logger
+
+LIMIT_ENABLED = Config["limit"]["enabled"].as_bool()
+LIMIT_SYNC = Config["limit"]["sync"].get(float)
+
+# NOTE: refill and consume a bucket stored as hash in one atomic step,
+# values are returned as strings since Redis truncates Lua numbers
+TOKEN_BUCKET_SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = tokens >= 1
+if allowed then
+    tokens = tokens - 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", ARGV[3])
+redis.call("PEXPIRE", KEYS[1], math.ceil(capacity / rate * 1000))
+if allowed then
+    return {1, "0"}
+end
+return {0, tostring((1 - tokens) / rate)}
+"""
+
+
+class RateLimit(BaseModel):
+    max: int
+    interval: float
+
+    @property
+    def rate(self) -> float:
+        """Tokens refilled per second"""
+        return self.max / self.interval
+
+
+LIMIT_DEFAULT = RateLimit(
+    max=Config["limit"]["max"].as_number(),
+    interval=Config["limit"]["interval"].get(float),
+)
+LIMIT_ROUTES = Config["limit"]["routes"].get(Optional[dict[str, RateLimit]]) or {}
+LIMIT_CREDENTIALS = (
+    Config["limit"]["credentials"].get(Optional[dict[str, RateLimit]]) or {}
+)
+
+
+@dataclass
+class TokenBucket:
+    limit: RateLimit
+    tokens: float
+    updated: float = field(default_factory=time.monotonic)
+
+    # NOTE: consumption is pre-aggregated locally and reconciled periodically
+    pending: int = 0
+    window: int = -1
+    flushed: int = 0
+    others: int = 0
+
+    def refill(self, now: float):
+        elapsed, self.updated = max(0, now - self.updated), now
+        self.tokens = min(self.limit.max, self.tokens + elapsed * self.limit.rate)
+
+    def acquire(self, now: float) -> Optional[float]:
+        """Consume one token, return seconds to wait if none is left"""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.pending += 1
+            return None
+        return (1 - self.tokens) / self.limit.rate
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending and self.tokens >= self.limit.max
+
+
+class RateLimiter:
+    """Token bucket rate limiter, keyed by client identity and route
+
+    With a Redis cache backend, each request runs one atomic script against
+    buckets shared by all workers. Otherwise every worker keeps its own
+    buckets, and when the cache backend is shared, flushes their consumption
+    into per-interval counters every `sync` seconds, draining local tokens by
+    what other workers consumed meanwhile.
+    """
+
+    prefix = "rate_limit"
+
+    def __init__(
+        self,
+        default: RateLimit,
+        routes: Optional[dict[str, RateLimit]] = None,
+        credentials: Optional[dict[str, RateLimit]] = None,
+        sync: float = LIMIT_SYNC,
+    ):
+        self.default, self.sync = default, sync
+        self.credentials = credentials or {}
+        # NOTE: longer prefixes are matched first
+        self.routes = dict(
+            sorted((routes or {}).items(), key=lambda item: -len(item[0]))
+        )
+        self.buckets: dict[str, TokenBucket] = {}
+        self.redis: Optional[Any] = None
+        self.script: Optional[Any] = None
+        self.reconciler: Optional[asyncio.Task[None]] = None
+
+    def resolve(
+        self, path: str, identity: str, credential: Optional[str] = None
+    ) -> tuple[str, RateLimit]:
+        """Pick the limit and bucket key applied to a request"""
+        route = next((prefix for prefix in self.routes if path.startswith(prefix)), "")
+        limit = self.routes.get(route, self.default)
+        if credential is not None:
+            identity = f"credential-{credential}"
+            limit = self.credentials.get(credential, limit)
+        return f"{self.prefix}:{route}:{identity}", limit
+
+    async def acquire(self, key: str, limit: RateLimit) -> Optional[float]:
+        """Consume one token of bucket `key`, return seconds to wait if limited"""
+        if self.script is not None:
+            try:
+                allowed, retry_after = await self.script(
+                    keys=[key], args=[limit.max, limit.rate, time.time()]
+                )
+                return None if int(allowed) else float(retry_after)
+            except Exception as e:
+                logger.warning(f"Rate limit script <r>failed</r>: {e!r}")
+        return self.acquire_local(key, limit)
+
+    def acquire_local(self, key: str, limit: RateLimit) -> Optional[float]:
+        if (bucket := self.buckets.get(key)) is None or bucket.limit != limit:
+            bucket = self.buckets[key] = TokenBucket(limit, tokens=limit.max)
+        return bucket.acquire(time.monotonic())
+
+    async def reconcile(self):
+        """Exchange locally aggregated consumption through the shared backend"""
+        now, wall = time.monotonic(), time.time()
+        for key, bucket in [*self.buckets.items()]:
+            bucket.refill(now)
+            if not CACHE_SHARED:
+                # NOTE: consumption is only flushed to a shared backend
+                bucket.pending = 0
+                if bucket.idle:
+                    self.buckets.pop(key, None)
+                continue
+
+            window = int(wall // bucket.limit.interval)
+            pending, bucket.pending = bucket.pending, 0
+            total = await cache.incr(
+                f"{key}:{window}", value=pending, expire=bucket.limit.interval * 2
+            )
+            if window != bucket.window:
+                bucket.window, bucket.flushed, bucket.others = window, 0, 0
+            bucket.flushed += pending
+
+            others = max(0, total - bucket.flushed)
+            bucket.tokens = max(0, bucket.tokens - (others - bucket.others))
+            bucket.others = others
+            if bucket.idle and not others:
+                self.buckets.pop(key, None)
+
+    async def _reconcile_forever(self):
+        while True:
+            await asyncio.sleep(self.sync)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Rate limit reconciliation <r>failed</r>: {e!r}")
+
+    async def start(self):
+        if not LIMIT_ENABLED:
+            return
+        if (redis := redis_client()) is not None:
+            self.redis = redis
+            self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.reconciler = asyncio.create_task(self._reconcile_forever())
+
+    async def stop(self):
+        if self.reconciler is not None:
+            self.reconciler.cancel()
+            await asyncio.gather(self.reconciler, return_exceptions=True)
+        self.redis = self.script = self.reconciler = None
+        self.buckets.clear()
+
+
+limiter = RateLimiter(LIMIT_DEFAULT, LIMIT_ROUTES, LIMIT_CREDENTIALS)
@@ -65,3 +65,8 @@ if LOG_FILE is not None:
     )
 
 logger.level(LOG_LEVEL)
+
+
+def level_enabled(level: str) -> bool:
+    """Whether messages of `level` will be emitted by configured sinks"""
+    return logger.level(level).no >= logger.level(LOG_LEVEL).no
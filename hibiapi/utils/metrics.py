@@ -0,0 +1,177 @@
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
+from typing import Callable, ClassVar
+
+from .config import Config
+
+METRICS_ENABLED = Config["metrics"]["enabled"].as_bool()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = tuple[str, ...]
+Sample = tuple[str, dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format(name: str, labels: dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {value:.17g}"
+
+
+class Metric:
+    """Base of metrics rendered in Prometheus text exposition format
+
+    Samples are only written by coroutines running on the event loop, so
+    updating them is plain dictionary arithmetic without any locking. Metrics
+    are exposed by the global registry unless created with `register=False`.
+    """
+
+    type: ClassVar[str] = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        *,
+        register: bool = True,
+    ):
+        self.name, self.documentation = name, documentation
+        self.labels = tuple(labels)
+        if register:
+            registry.register(self)
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for name, labels, value in self.samples():
+            yield _format(name, labels, value)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        *,
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labels, register=register)
+        self.values: defaultdict[Labels, float] = defaultdict(float)
+
+    def inc(self, *labels: str, value: float = 1):
+        self.values[labels] += value
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self.values.items():
+            yield self.name, dict(zip(self.labels, labels)), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        *,
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labels, register=register)
+        self.buckets = tuple(sorted(buckets))
+        # NOTE: per label values, non-cumulative bucket counts then sum
+        self.values: dict[Labels, list[float]] = {}
+
+    def observe(self, *labels: str, value: float):
+        if (counts := self.values.get(labels)) is None:
+            counts = self.values[labels] = [0.0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, counts in self.values.items():
+            label_dict, cumulative = dict(zip(self.labels, labels)), 0.0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    {**label_dict, "le": f"{bound}"},
+                    cumulative,
+                )
+            yield f"{self.name}_count", label_dict, cumulative
+            yield f"{self.name}_sum", label_dict, counts[-1]
+
+
+class Collected(Metric):
+    """Metric read from existing statistics objects when being scraped"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str],
+        collect: Callable[[], Iterable[tuple[Labels, float]]],
+        type: str = "gauge",
+        *,
+        register: bool = True,
+    ):
+        super().__init__(name, documentation, labels, register=register)
+        self.collect, self.type = collect, type  # type:ignore
+
+    def samples(self) -> Iterable[Sample]:
+        for labels, value in self.collect():
+            yield self.name, dict(zip(self.labels, labels)), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        # NOTE: a second metric of the same name would silently replace it
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(
+            line for metric in self.metrics.values() for line in metric.render()
+        )
+
+
+registry = MetricsRegistry()
+
+route_requests = Histogram(
+    "hibiapi_route_request_seconds",
+    "Latency of requests handled by each route",
+    labels=("method", "route", "status"),
+)
+upstream_requests = Histogram(
+    "hibiapi_upstream_request_seconds",
+    "Latency of requests sent to each upstream, including retries",
+    labels=("upstream", "method", "status"),
+)
+cache_requests = Counter(
+    "hibiapi_cache_requests_total",
+    "Endpoint cache lookups by namespace and cache status",
+    labels=("namespace", "status"),
+)
+auth_refreshes = Counter(
+    "hibiapi_auth_refreshes_total",
+    "Upstream account credential refreshes",
+    labels=("upstream", "result"),
+)
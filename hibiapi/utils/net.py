@@ -1,5 +1,8 @@
 import functools
+import time
 from collections.abc import Coroutine
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from types import TracebackType
 from typing import (
     Any,
@@ -16,22 +19,124 @@ from httpx import (
     Cookies,
     HTTPError,
     HTTPStatusError,
+    Limits,
+    PoolTimeout,
     Request,
     Response,
-    ResponseNotRead,
+    Timeout,
     TransportError,
 )
+from pydantic import BaseModel, Field
 
-from .decorators import Retry, TimeIt
+from .circuit import CircuitBreaker, CircuitOpenError
+from .config import Config
+from .decorators import Retry, RetryBudget, TimeIt
 from .exceptions import UpstreamAPIException
-from .log import logger
+from .log import level_enabled, logger
+from .metrics import METRICS_ENABLED, Collected, upstream_requests
+from .tracing import span
 
 AsyncCallable_T = TypeVar("AsyncCallable_T", bound=Callable[..., Coroutine])
 
+RETRY_TIMES = Config["retry"]["times"].as_number()
+RETRY_DELAY = Config["retry"]["delay"].get(float)
+RETRY_MAX_DELAY = Config["retry"]["max-delay"].get(float)
+RETRY_RATIO = Config["retry"]["ratio"].get(float)
+RETRY_BURST = Config["retry"]["burst"].get(float)
+RETRY_STATUS_CODES = frozenset(Config["retry"]["status"].get(list[int]))
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class TimeoutConfig(BaseModel):
+    connect: Optional[float] = 5
+    read: Optional[float] = 5
+    write: Optional[float] = 5
+    pool: Optional[float] = 5
+
+
+class PoolConfig(BaseModel):
+    """Connection pool settings, read from `pool` section of site config"""
+
+    http2: bool = True
+    max_connections: Optional[int] = Field(100, alias="max-connections")
+    max_keepalive: Optional[int] = Field(20, alias="max-keepalive")
+    keepalive_expiry: Optional[float] = Field(5, alias="keepalive-expiry")
+    timeout: TimeoutConfig = TimeoutConfig()
+
+    @property
+    def limits(self) -> Limits:
+        return Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    @property
+    def timeouts(self) -> Timeout:
+        return Timeout(**self.timeout.dict())
+
+
+class PoolStatistics:
+    """Time spent by requests waiting for a connection from the pool
+
+    Waits are only measured when `enabled`, since it costs a trace callback
+    per request, while pool timeouts are always counted.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.waits, self.wait_seconds, self.max_wait_seconds = 0, 0.0, 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float):
+        self.waits += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class RetryableStatusError(HTTPStatusError):
+    """Raised internally for a response of idempotent request worth retrying"""
+
+    def __init__(self, response: Response):
+        super().__init__(
+            f"Retryable status code {response.status_code}",
+            request=response.request,
+            response=response,
+        )
+        self.retry_after = self._parse_retry_after(response)
+
+    @staticmethod
+    def _parse_retry_after(response: Response) -> Optional[float]:
+        if (value := response.headers.get("retry-after")) is None:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
 
 class AsyncHTTPClient(AsyncClient):
     net_client: "BaseNetClient"
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        for event, hooks in self._default_event_hooks().items():
+            self.event_hooks[event].extend(hooks)
+
+    @classmethod
+    def _default_event_hooks(cls) -> dict[str, list[Callable[..., Any]]]:
+        """Hooks registered once for every request sent by the client"""
+        hooks: dict[str, list[Callable[..., Any]]] = {"request": [], "response": []}
+        if level_enabled("DEBUG"):
+            hooks["request"].append(cls._log_request)
+            hooks["response"].append(cls._log_response)
+        return hooks
+
     @staticmethod
     async def _log_request(request: Request):
         method, url = request.method, request.url
@@ -41,41 +146,128 @@ class AsyncHTTPClient(AsyncClient):
 
     @staticmethod
     async def _log_response(response: Response):
-        method, url = response.request.method, response.url
-        try:
-            length, code = len(response.content), response.status_code
-        except ResponseNotRead:
-            length, code = -1, response.status_code
+        # NOTE: body is not read yet, and must stay unread for streaming
+        method, url, code = response.request.method, response.url, response.status_code
+        length = response.headers.get("content-length", -1)
         logger.debug(
             f"Network request <g>finished</g>: <b><e>{method}</e> "
             f"<u>{url}</u> <m>{code}</m></b> <m>{length}</m>"
         )
 
-    @Retry(exceptions=[TransportError])
+    @Retry(
+        retries=RETRY_TIMES,
+        delay=RETRY_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        exceptions=[TransportError, RetryableStatusError],
+        budget=lambda self, *args, **kwargs: self.net_client.retry_budget,
+    )
+    async def _request(self, method: str, url: Union[URL, str], **kwargs):
+        with span("upstream.attempt") as attempt:
+            response = await super().request(method, url, **kwargs)
+            if attempt is not None:
+                attempt.attributes["status"] = response.status_code
+        if (
+            response.status_code in RETRY_STATUS_CODES
+            and method.upper() in IDEMPOTENT_METHODS
+        ):
+            await response.aclose()
+            raise RetryableStatusError(response)
+        return response
+
     async def request(self, method: str, url: Union[URL, str], **kwargs):
-        self.event_hooks = {
-            "request": [self._log_request],
-            "response": [self._log_response],
-        }
-        return await super().request(method, url, **kwargs)
+        breaker = self.net_client.circuit_breaker
+        ticket = breaker.acquire()
+
+        started, failed, status = time.perf_counter(), None, "error"
+        try:
+            with span("upstream.request", upstream=self.net_client.upstream) as trace:
+                if trace is not None:
+                    trace.attributes["method"] = method.upper()
+                    trace.attributes["url"] = f"{URL(url).copy_with(query=None)}"
+                try:
+                    response = await self._request(method, url, **kwargs)
+                except RetryableStatusError as e:
+                    response = e.response
+            failed, status = response.status_code >= 500, f"{response.status_code}"
+            return response
+        except HTTPError:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            breaker.release(ticket, failed, elapsed)
+            upstream_requests.observe(
+                self.net_client.upstream, method.upper(), status, value=elapsed
+            )
+
+    async def send(self, request: Request, **kwargs) -> Response:
+        statistics = self.net_client.pool_statistics
+        started, waited = time.perf_counter(), None
+
+        if statistics.enabled:
+            chained = request.extensions.get("trace")
+
+            # NOTE: the first trace event is emitted by httpcore once a
+            # connection has been acquired from pool, so time before it is
+            # the pool wait
+            async def trace(event_name: str, info: dict[str, Any]):
+                nonlocal waited
+                if waited is None:
+                    waited = time.perf_counter() - started
+                if chained is not None:
+                    await chained(event_name, info)
+
+            request.extensions["trace"] = trace
+        try:
+            return await super().send(request, **kwargs)
+        except PoolTimeout:
+            statistics.timeouts += 1
+            raise
+        finally:
+            if waited is not None:
+                statistics.observe(waited)
 
 
 class BaseNetClient:
     connections: ClassVar[int] = 0
     clients: ClassVar[list[AsyncHTTPClient]] = []
+    upstreams: ClassVar[dict[str, type["BaseNetClient"]]] = {}
+
+    upstream: ClassVar[str] = "base"
+    pool_statistics: ClassVar[PoolStatistics] = PoolStatistics()
+    retry_budget: ClassVar[RetryBudget] = RetryBudget(RETRY_RATIO, RETRY_BURST)
+    circuit_breaker: ClassVar[CircuitBreaker] = CircuitBreaker(upstream)
 
     client: Optional[AsyncHTTPClient] = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # NOTE: `hibiapi.api.pixiv.net.NetRequest` is named as `pixiv`
+        module = cls.__module__.removeprefix("hibiapi.api.").removesuffix(".net")
+        cls.upstream = module if module != cls.__module__ else cls.__qualname__
+        # NOTE: every upstream has its own statistics unless explicitly given
+        defaults = {
+            "pool_statistics": lambda: PoolStatistics(),
+            "retry_budget": lambda: RetryBudget(RETRY_RATIO, RETRY_BURST),
+            "circuit_breaker": lambda: CircuitBreaker(cls.upstream),
+        }
+        for name, factory in defaults.items():
+            if name not in cls.__dict__:
+                setattr(cls, name, factory())
+        BaseNetClient.upstreams[cls.upstream] = cls
+
     def __init__(
         self,
         headers: Optional[dict[str, Any]] = None,
         cookies: Optional[Cookies] = None,
         proxies: Optional[dict[str, str]] = None,
         client_class: type[AsyncHTTPClient] = AsyncHTTPClient,
+        pool: Optional[PoolConfig] = None,
     ):
         self.cookies, self.client_class = cookies or Cookies(), client_class
         self.headers: dict[str, Any] = headers or {}
         self.proxies: Any = proxies or {}  # Bypass type checker
+        self.pool = pool or PoolConfig()
 
         self.create_client()
 
@@ -84,7 +276,9 @@ class BaseNetClient:
             headers=self.headers,
             proxies=self.proxies,
             cookies=self.cookies,
-            http2=True,
+            http2=self.pool.http2,
+            limits=self.pool.limits,
+            timeout=self.pool.timeouts,
             follow_redirects=True,
         )
         self.client.net_client = self
@@ -115,6 +309,61 @@ class BaseNetClient:
         return
 
 
+def _collect(getter: Callable[[type[BaseNetClient]], float]):
+    def collect():
+        for name, net_client in sorted(BaseNetClient.upstreams.items()):
+            yield (name,), getter(net_client)
+
+    return collect
+
+
+Collected(
+    "hibiapi_upstream_pool_waits_total",
+    "Requests which acquired a connection from the pool",
+    labels=("upstream",),
+    collect=_collect(lambda net_client: net_client.pool_statistics.waits),
+    type="counter",
+)
+Collected(
+    "hibiapi_upstream_pool_wait_seconds_total",
+    "Time spent waiting for a connection from the pool",
+    labels=("upstream",),
+    collect=_collect(lambda net_client: net_client.pool_statistics.wait_seconds),
+    type="counter",
+)
+Collected(
+    "hibiapi_upstream_pool_timeouts_total",
+    "Requests which timed out waiting for a connection from the pool",
+    labels=("upstream",),
+    collect=_collect(lambda net_client: net_client.pool_statistics.timeouts),
+    type="counter",
+)
+Collected(
+    "hibiapi_upstream_retries_total",
+    "Retried upstream requests",
+    labels=("upstream",),
+    collect=_collect(lambda net_client: net_client.retry_budget.retries),
+    type="counter",
+)
+Collected(
+    "hibiapi_upstream_retries_exhausted_total",
+    "Upstream retries skipped because the retry budget is exhausted",
+    labels=("upstream",),
+    collect=_collect(lambda net_client: net_client.retry_budget.exhausted),
+    type="counter",
+)
+Collected(
+    "hibiapi_upstream_circuit_open",
+    "Whether the circuit of upstream is open (1), half open (0.5) or closed (0)",
+    labels=("upstream",),
+    collect=_collect(
+        lambda net_client: {"open": 1, "half_open": 0.5}.get(
+            net_client.circuit_breaker.state.value, 0
+        )
+    ),
+)
+
+
 def catch_network_error(function: AsyncCallable_T) -> AsyncCallable_T:
     timed_func = TimeIt(function)
 
@@ -124,6 +373,12 @@ def catch_network_error(function: AsyncCallable_T) -> AsyncCallable_T:
             return await timed_func(*args, **kwargs)
         except HTTPStatusError as e:
             raise UpstreamAPIException(detail=e.response.text) from e
+        except CircuitOpenError as e:
+            raise UpstreamAPIException(
+                detail=str(e),
+                code=503,
+                headers={"Retry-After": f"{e.retry_after:.0f}"},
+            ) from e
         except HTTPError as e:
             raise UpstreamAPIException from e
 
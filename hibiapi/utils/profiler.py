@@ -0,0 +1,73 @@
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Optional
+
+from .config import Config
+
+PROFILING_INTERVAL = Config["profiling"]["interval"].get(float)
+PROFILING_MAX_DURATION = Config["profiling"]["max-duration"].get(float)
+PROFILING_TOKEN = Config["profiling"]["token"].get_optional(str) or None
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "<unknown>")
+    name = getattr(code, "co_qualname", code.co_name)
+    # NOTE: semicolons separate frames in collapsed stacks
+    return f"{name} ({module}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """Format a stack root first, as a line of flamegraph collapsed stacks"""
+    labels: list[str] = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Periodically sample the stack of one thread from a background thread
+
+    Sampling the event loop thread from outside shows where it spends CPU
+    without instrumenting any code, at the cost of reading one stack every
+    `interval` seconds.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILING_INTERVAL):
+        self.thread_id, self.interval = thread_id, interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def sample(self):
+        if (frame := sys._current_frames().get(self.thread_id)) is None:
+            return
+        self.stacks[collapse_stack(frame)] += 1
+        self.samples += 1
+
+    def run(self, duration: Optional[float] = None):
+        """Sample until stopped or `duration` seconds passed, blocking"""
+        deadline = None if duration is None else time.monotonic() + duration
+        while not self.stopped.wait(self.interval):
+            self.sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
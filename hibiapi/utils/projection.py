@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from .exceptions import ClientSideException
+
+FIELDS_MAX_LENGTH = 1024
+
+Plan = dict[str, Optional["Plan"]]
+"""Selected keys mapped to the plan of their children, `None` keeps all"""
+
+_TOKEN = re.compile(r"\s*(?:([{},])|([^{},\s]+))")
+
+
+class FieldsSyntaxError(ClientSideException):
+    detail = "Invalid fields selection"
+
+
+def _merge(plan: Plan, name: str, children: Optional[Plan]):
+    if name not in plan:
+        plan[name] = children
+    elif (existing := plan[name]) is not None:
+        if children is None:
+            plan[name] = None
+        else:
+            for child, grandchildren in children.items():
+                _merge(existing, child, grandchildren)
+
+
+def compile_fields(expression: str) -> Plan:
+    """Compile a selection like `illusts{id,title,tags{name}},next_url`
+
+    Nested selections apply to every item when the value is a list.
+    """
+    if len(expression) > FIELDS_MAX_LENGTH:
+        raise FieldsSyntaxError(f"Selection longer than {FIELDS_MAX_LENGTH}")
+    tokens: list[str] = []
+    position, expression = 0, expression.rstrip()
+    while position < len(expression):
+        if (match := _TOKEN.match(expression, position)) is None:
+            raise FieldsSyntaxError(f"Unexpected character at {position}")
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+
+    def selection(index: int, depth: int) -> tuple[Plan, int]:
+        plan: Plan = {}
+        while True:
+            if index >= len(tokens) or tokens[index] in "{},":
+                raise FieldsSyntaxError(f"Expected field name at token {index}")
+            name, index = tokens[index], index + 1
+            children = None
+            if index < len(tokens) and tokens[index] == "{":
+                children, index = selection(index + 1, depth + 1)
+                if index >= len(tokens) or tokens[index] != "}":
+                    raise FieldsSyntaxError(f"Unclosed selection of {name!r}")
+                index += 1
+            _merge(plan, name, children)
+            if index < len(tokens) and tokens[index] == ",":
+                index += 1
+                continue
+            if depth == 0 and index < len(tokens):
+                raise FieldsSyntaxError(f"Unexpected {tokens[index]!r}")
+            return plan, index
+
+    return selection(0, 0)[0]
+
+
+def _render(plan: Plan) -> str:
+    return ",".join(
+        name if children is None else f"{name}{{{_render(children)}}}"
+        for name, children in sorted(plan.items())
+    )
+
+
+@lru_cache(maxsize=1024)
+def normalize_fields(expression: str) -> str:
+    """Canonical form of a selection, equal for equivalent selections"""
+    return _render(compile_fields(expression))
+
+
+Projector = Callable[[Any], Any]
+
+
+def _keep(value: Any) -> Any:
+    return value
+
+
+def build_projector(plan: Optional[Plan]) -> Projector:
+    """Turn `plan` into nested closures, avoiding plan lookups per item"""
+    if plan is None:
+        return _keep
+    names = tuple(plan)
+    children = tuple(
+        (name, build_projector(child)) for name, child in plan.items() if child
+    )
+
+    def projector(value: Any) -> Any:
+        if isinstance(value, list):
+            return [projector(item) for item in value]
+        elif not isinstance(value, dict):
+            return value
+        selected = {name: value[name] for name in names if name in value}
+        for name, child in children:
+            if name in selected:
+                selected[name] = child(selected[name])
+        return selected
+
+    return projector
+
+
+@lru_cache(maxsize=1024)
+def compile_projector(expression: str) -> Projector:
+    """Compiled projector of a selection, which leaves its input untouched"""
+    return build_projector(compile_fields(expression))
@@ -7,19 +7,26 @@ from functools import wraps
 from typing import Annotated, Any, Callable, Literal, Optional
 from urllib.parse import ParseResult, urlparse
 
-from fastapi import Depends, Request
+from fastapi import Depends, Query, Request, Response
 from fastapi.routing import APIRouter
 from httpx import URL
 from pydantic import AnyHttpUrl
 from pydantic.errors import UrlHostError
 from starlette.datastructures import Headers, MutableHeaders
 
-from hibiapi.utils.cache import endpoint_cache
+from hibiapi.utils.cache import CACHE_RAW_KEY, endpoint_cache
+from hibiapi.utils.encoding import FastJSONResponse
 from hibiapi.utils.net import AsyncCallable_T, AsyncHTTPClient, BaseNetClient
+from hibiapi.utils.projection import FIELDS_MAX_LENGTH, compile_projector
 
 DONT_ROUTE_KEY = "_dont_route"
 
 
+def as_response(result: Any) -> Response:
+    # NOTE: returning a response skips FastAPI's `jsonable_encoder` pass
+    return result if isinstance(result, Response) else FastJSONResponse(result)
+
+
 def dont_route(func: AsyncCallable_T) -> AsyncCallable_T:
     setattr(func, DONT_ROUTE_KEY, True)
     return func
@@ -95,6 +102,20 @@ class EndpointRouter(SlashRouter):
         func_params = inspect.signature(func).parameters
         return {k: v for k, v in params.items() if k in func_params}
 
+    @staticmethod
+    async def _call_endpoint(
+        func: Callable,
+        endpoint: BaseEndpoint,
+        fields: Optional[str],
+        params: dict[str, Any],
+    ) -> Response:
+        if raw_func := getattr(func, CACHE_RAW_KEY, None):
+            return as_response(await raw_func(endpoint, fields=fields, **params))
+        if fields:
+            projector = compile_projector(fields)
+            return as_response(projector(await func(endpoint, **params)))
+        return as_response(await func(endpoint, **params))
+
     @staticmethod
     def _router_signature_convert(
         func,
@@ -103,9 +124,13 @@ class EndpointRouter(SlashRouter):
         method_name: Optional[str] = None,
     ):
         @wraps(func)
-        async def route_func(endpoint: endpoint_class, **kwargs):
-            endpoint_method = getattr(endpoint, method_name or func.__name__)
-            return await endpoint_method(**kwargs)
+        async def route_func(
+            endpoint: endpoint_class, fields: Optional[str] = None, **kwargs
+        ):
+            endpoint_method = getattr(type(endpoint), method_name or func.__name__)
+            return await EndpointRouter._call_endpoint(
+                endpoint_method, endpoint, fields, kwargs
+            )
 
         route_func.__signature__ = inspect.signature(route_func).replace(  # type:ignore
             parameters=[
@@ -120,6 +145,17 @@ class EndpointRouter(SlashRouter):
                     for param in inspect.signature(func).parameters.values()
                     if param.kind == inspect.Parameter.KEYWORD_ONLY
                 ),
+                inspect.Parameter(
+                    name="fields",
+                    kind=inspect.Parameter.KEYWORD_ONLY,
+                    annotation=Optional[str],
+                    default=Query(
+                        None,
+                        max_length=FIELDS_MAX_LENGTH,
+                        description="Only return selected fields, "
+                        "e.g. `illusts{id,title,tags{name}},next_url`",
+                    ),
+                ),
             ]
         )
         return route_func
@@ -158,8 +194,9 @@ class EndpointRouter(SlashRouter):
             type: Literal[tuple(router_functions.keys())],  # type: ignore
         ):
             func = router_functions[type]
-            return await func(
-                endpoint, **self._exclude_params(func, request.query_params)
+            params = self._exclude_params(func, request.query_params)
+            return await self._call_endpoint(
+                func, endpoint, request.query_params.get("fields"), params
             )
 
 
@@ -0,0 +1,155 @@
+import random
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Optional
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from .config import Config
+
+TRACING_ENABLED = Config["tracing"]["enabled"].as_bool()
+TRACING_SAMPLE = Config["tracing"]["sample"].get(float)
+TRACING_BUFFER = Config["tracing"]["buffer"].as_number()
+
+
+class SpanModel(BaseModel):
+    name: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: float
+    duration: Optional[float] = None
+    attributes: dict[str, Any] = {}
+    error: Optional[str] = None
+
+
+class TraceModel(BaseModel):
+    trace_id: str
+    name: str
+    start: float
+    duration: Optional[float] = None
+    spans: list[SpanModel]
+
+
+@dataclass
+class Trace:
+    trace_id: str = field(default_factory=lambda: uuid4().hex)
+    spans: list["Span"] = field(default_factory=list)
+
+    def model(self) -> TraceModel:
+        root, *_ = self.spans
+        return TraceModel(
+            trace_id=self.trace_id,
+            name=root.name,
+            start=root.start,
+            duration=root.duration,
+            spans=[span.model() for span in self.spans],
+        )
+
+
+@dataclass
+class Span:
+    trace: Trace
+    name: str
+    parent_id: Optional[str] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: uuid4().hex[:16])
+    start: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.perf_counter)
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = repr(error)
+
+    def model(self) -> SpanModel:
+        return SpanModel(
+            name=self.name,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            start=self.start,
+            duration=self.duration,
+            attributes=self.attributes,
+            error=self.error,
+        )
+
+
+current_span = ContextVar[Optional[Span]]("current_span", default=None)
+
+
+class span:
+    """Record a child span of the current one, if the request is sampled
+
+    Unsampled requests have no current span, so entering only costs a
+    context variable lookup.
+    """
+
+    __slots__ = ("name", "attributes", "span", "token")
+
+    def __init__(self, name: str, **attributes: Any):
+        self.name, self.attributes = name, attributes
+        self.span: Optional[Span] = None
+        self.token: Optional[Token[Optional[Span]]] = None
+
+    def __enter__(self) -> Optional[Span]:
+        if (parent := current_span.get()) is None:
+            return None
+        self.span = Span(
+            parent.trace, self.name, parent.span_id, attributes=self.attributes
+        )
+        parent.trace.spans.append(self.span)
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.span is None or self.token is None:
+            return
+        self.span.finish(exc_value)
+        try:
+            current_span.reset(self.token)
+        except ValueError:
+            # NOTE: span exited in another context, e.g. a shielded task
+            current_span.set(None)
+
+
+class Tracer:
+    """Head-sampled in-process tracer keeping recent traces in a ring buffer"""
+
+    def __init__(
+        self,
+        enabled: bool = TRACING_ENABLED,
+        sample: float = TRACING_SAMPLE,
+        buffer: int = TRACING_BUFFER,
+    ):
+        self.enabled, self.sample = enabled, sample
+        self.traces: deque[Trace] = deque(maxlen=buffer)
+
+    def start(self, name: str, **attributes: Any) -> Optional[Span]:
+        """Decide whether to sample a new trace, and start its root span"""
+        if not self.enabled or random.random() >= self.sample:
+            return None
+        trace = Trace()
+        trace.spans.append(root := Span(trace, name, attributes=attributes))
+        return root
+
+    def finish(self, root: Span, error: Optional[BaseException] = None):
+        root.finish(error)
+        self.traces.append(root.trace)
+
+    def recent(
+        self, limit: Optional[int] = None, min_duration: float = 0
+    ) -> list[TraceModel]:
+        traces = (
+            trace
+            for trace in reversed(self.traces)
+            if (trace.spans[0].duration or 0) >= min_duration
+        )
+        return [trace.model() for trace in islice(traces, limit)]
+
+
+tracer = Tracer()
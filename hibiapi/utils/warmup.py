@@ -0,0 +1,120 @@
+import asyncio
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .cache import CACHE_REFRESH_KEY
+from .config import APIConfig, Config
+from .log import logger
+from .net import BaseNetClient
+from .routing import BaseEndpoint, request_headers, response_headers
+
+WARMUP_ENABLED = Config["warmup"]["enabled"].as_bool()
+WARMUP_CONCURRENCY = Config["warmup"]["concurrency"].as_number()
+WARMUP_INTERVAL = timedelta(seconds=Config["warmup"]["interval"].as_number())
+
+WarmupParams = Callable[[], Iterable[dict[str, Any]]]
+
+
+@dataclass
+class WarmupJob:
+    config: APIConfig
+    endpoint_class: type[BaseEndpoint]
+    net_client: BaseNetClient
+    method: str
+    params: WarmupParams
+
+    @property
+    def name(self) -> str:
+        return f"{self.endpoint_class.__qualname__}.{self.method}"
+
+
+class WarmupScheduler:
+    """Periodically refresh predictable hot cache keys before they expire
+
+    All jobs share one semaphore, so that warm-up requests are limited to
+    `concurrency` at a time and do not compete with live traffic. Jobs run
+    on startup, every `interval`, and right after local midnight when
+    date-dependent parameters change.
+    """
+
+    def __init__(self, concurrency: int, interval: timedelta):
+        self.concurrency, self.interval = concurrency, interval
+        self.jobs: list[WarmupJob] = []
+        self.tasks: list[asyncio.Task[None]] = []
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    def register(
+        self,
+        config: APIConfig,
+        endpoint_class: type[BaseEndpoint],
+        net_client: BaseNetClient,
+        method: str,
+        params: Optional[WarmupParams] = None,
+    ):
+        self.jobs.append(
+            WarmupJob(
+                config=config,
+                endpoint_class=endpoint_class,
+                net_client=net_client,
+                method=method,
+                params=params or (lambda: [{}]),
+            )
+        )
+
+    async def _refresh(self, job: WarmupJob, params: dict[str, Any]) -> bool:
+        assert self.semaphore is not None
+        async with self.semaphore, job.net_client as client:
+            request_headers.set(Headers())
+            response_headers.set(MutableHeaders())
+            endpoint = job.endpoint_class(client)
+            refresh = getattr(getattr(endpoint, job.method), CACHE_REFRESH_KEY)
+            return await refresh(self.interval, endpoint, **params)
+
+    async def run(self, job: WarmupJob):
+        results = await asyncio.gather(
+            *(self._refresh(job, params) for params in job.params()),
+            return_exceptions=True,
+        )
+        refreshed = sum(result is True for result in results)
+        for error in (e for e in results if isinstance(e, Exception)):
+            logger.warning(f"Warm-up of <y>{job.name}</y> <r>failed</r>: {error!r}")
+        logger.debug(
+            f"Warm-up of <y>{job.name}</y> refreshed "
+            f"<m>{refreshed}</m>/<m>{len(results)}</m> keys"
+        )
+
+    def _next_delay(self) -> float:
+        now = datetime.now()
+        midnight = (now + timedelta(days=1)).replace(
+            hour=0, minute=0, second=1, microsecond=0
+        )
+        return min(self.interval, midnight - now).total_seconds()
+
+    async def _schedule(self, job: WarmupJob):
+        while True:
+            await self.run(job)
+            await asyncio.sleep(self._next_delay())
+
+    async def start(self):
+        if not WARMUP_ENABLED:
+            return
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.tasks = [
+            asyncio.create_task(self._schedule(job))
+            for job in self.jobs
+            if job.config["enabled"].as_bool()
+        ]
+        logger.info(f"Cache warm-up scheduled for <m>{len(self.tasks)}</m> endpoints")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+
+
+scheduler = WarmupScheduler(WARMUP_CONCURRENCY, WARMUP_INTERVAL)
@@ -0,0 +1,111 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from .config import Config
+from .log import logger
+from .metrics import Counter, Histogram
+from .profiler import collapse_stack
+
+WATCHDOG_ENABLED = Config["watchdog"]["enabled"].as_bool()
+WATCHDOG_INTERVAL = Config["watchdog"]["interval"].get(float)
+WATCHDOG_THRESHOLD = Config["watchdog"]["threshold"].get(float)
+
+loop_lag = Histogram(
+    "hibiapi_event_loop_lag_seconds",
+    "Delay of event loop heartbeats behind their schedule",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+loop_blocked = Counter(
+    "hibiapi_event_loop_blocked_total",
+    "Times the event loop was blocked longer than the watchdog threshold",
+)
+
+
+class BlockingCall(BaseModel):
+    time: datetime
+    blocked: float
+    stack: str
+
+
+class LoopWatchdog:
+    """Measure event loop lag and capture stacks of blocking code
+
+    A heartbeat coroutine on the loop records how late it wakes up, while a
+    watcher thread notices when the heartbeat stalls for more than
+    `threshold` seconds and captures the stack of the loop thread at that
+    moment, which is most likely the blocking code.
+    """
+
+    def __init__(
+        self,
+        interval: float = WATCHDOG_INTERVAL,
+        threshold: float = WATCHDOG_THRESHOLD,
+        history: int = 50,
+    ):
+        self.interval, self.threshold = interval, threshold
+        self.blocking_calls: deque[BlockingCall] = deque(maxlen=history)
+        self.beat = time.monotonic()
+        self.loop_thread: Optional[int] = None
+        self.heartbeat: Optional[asyncio.Task[None]] = None
+        self.watcher: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    async def _heartbeat(self):
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            loop_lag.observe(value=max(0, time.monotonic() - self.beat - self.interval))
+
+    def _watch(self):
+        reported: Optional[float] = None
+        while not self.stopped.wait(self.interval / 2):
+            beat, now = self.beat, time.monotonic()
+            blocked = now - beat - self.interval
+            if blocked < self.threshold or beat == reported:
+                continue
+            reported = beat
+            assert self.loop_thread is not None
+            if (frame := sys._current_frames().get(self.loop_thread)) is None:
+                continue
+            self.blocking_calls.append(
+                BlockingCall(
+                    time=datetime.now(), blocked=blocked, stack=collapse_stack(frame)
+                )
+            )
+            loop_blocked.inc()
+            logger.opt(colors=False).warning(
+                f"Event loop blocked for more than {blocked:.3f}s at:\n"
+                + "".join(traceback.format_stack(frame))
+            )
+
+    async def start(self):
+        if not WATCHDOG_ENABLED:
+            return
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopped.clear()
+        self.heartbeat = asyncio.create_task(self._heartbeat())
+        self.watcher = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self.watcher.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            await asyncio.gather(self.heartbeat, return_exceptions=True)
+        if self.watcher is not None:
+            await asyncio.to_thread(self.watcher.join)
+        self.heartbeat = self.watcher = None
+
+
+watchdog = LoopWatchdog()
@@ -122,3 +122,478 @@ def test_net_request():
         response = client.post("teapot", json=test_data)
         exception_return = ExceptionReturn.parse_obj(response.json())
         assert exception_return.code == response.status_code
+
+
+def test_middlewares(client: TestClient):
+    response = client.get("/docs")
+    assert float(response.headers["X-Process-Time"]) >= 0
+
+    response = client.get("/qrcode/", follow_redirects=False)
+    assert response.status_code == 301
+    assert response.headers["Location"] == "http://testserver/api/qrcode/"
+
+
+def test_compression_middleware():
+    from fastapi import FastAPI, Response
+    from fastapi.responses import StreamingResponse
+
+    from hibiapi.app.middlewares import CompressionMiddleware
+    from hibiapi.utils.compression import DECOMPRESSORS
+
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+    payload = {"text": "hibiapi " * 100}
+
+    @app.get("/large")
+    def large():
+        return payload
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    @app.get("/tagged")
+    def tagged():
+        return Response(
+            b"{}" + b" " * 1000,
+            media_type="application/json",
+            headers={"ETag": '"tagged"'},
+        )
+
+    @app.get("/image")
+    def image():
+        return Response(b"\x00" * 1000, media_type="image/png")
+
+    @app.get("/stream")
+    def stream():
+        chunks = (f"line {index}\n".encode() for index in range(100))
+        return StreamingResponse(chunks, media_type="text/plain")
+
+    with TestClient(app) as client:
+        response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.json() == payload
+
+        response = client.get("/large", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+
+        response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+        # NOTE: each coding of a body has its own strong entity tag
+        response = client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["etag"] == '"tagged-gzip"'
+        response = client.get("/tagged", headers={"Accept-Encoding": "identity"})
+        assert response.headers["etag"] == '"tagged"'
+
+        response = client.get("/image", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+        # NOTE: streamed responses are compressed chunk by chunk
+        response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert response.text == "".join(f"line {index}\n" for index in range(100))
+
+    assert "gzip" in DECOMPRESSORS
+
+
+def test_encode_json():
+    import json
+    from datetime import datetime
+    from enum import Enum
+
+    from pydantic import BaseModel
+
+    from hibiapi.utils.encoding import decode_json, encode_json, encode_json_compatible
+
+    from .test_cache import illust_page
+
+    class Color(str, Enum):
+        red = "red"
+
+    class Model(BaseModel):
+        color: Color
+        time: datetime
+
+    value = {
+        **illust_page(),
+        "model": Model(color=Color.red, time=datetime(2024, 1, 1, 12)),
+        "keys": {1: "one", 2: "two"},
+        "huge": 1 << 70,
+    }
+    assert json.loads(encode_json(value)) == json.loads(encode_json_compatible(value))
+    assert decode_json(encode_json(value))["huge"] == 1 << 70
+    assert decode_json(encode_json(value))["model"] == {
+        "color": "red",
+        "time": "2024-01-01T12:00:00",
+    }
+
+
+def test_uncached_response_encoding(monkeypatch: pytest.MonkeyPatch):
+    import fastapi.routing
+    from fastapi import FastAPI
+
+    from hibiapi.app.middlewares import ContextVarMiddleware
+    from hibiapi.utils.net import BaseNetClient
+    from hibiapi.utils.routing import BaseEndpoint, EndpointRouter
+
+    class UncachedEndpoint(BaseEndpoint):
+        async def value(self, *, id: int = 1):
+            return {"id": id}
+
+    class UncachedNetClient(BaseNetClient):
+        pass
+
+    encoded = 0
+    jsonable_encoder = fastapi.routing.jsonable_encoder
+
+    def counting_encoder(*args, **kwargs):
+        nonlocal encoded
+        encoded += 1
+        return jsonable_encoder(*args, **kwargs)
+
+    monkeypatch.setattr(fastapi.routing, "jsonable_encoder", counting_encoder)
+
+    router = EndpointRouter()
+    router.include_endpoint(UncachedEndpoint, UncachedNetClient())
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(ContextVarMiddleware)
+
+    with TestClient(app) as client:
+        for headers in ({}, {"Cache-Control": "no-store"}):
+            response = client.get("/value", params={"id": 2}, headers=headers)
+            assert response.json() == {"id": 2}
+    # NOTE: uncached results are encoded by `FastJSONResponse` as well
+    assert encoded == 0
+
+
+@pytest.mark.parametrize("encoder", ["jsonable_encoder", "orjson"])
+def test_json_encode_benchmark(benchmark: BenchmarkFixture, encoder: str):
+    import json
+    from pathlib import Path
+
+    from hibiapi.utils.encoding import encode_json, encode_json_compatible
+
+    if encoder == "orjson":
+        pytest.importorskip("orjson")
+
+    # NOTE: a day ranking page of `PixivEndpoints.rank` with every field of
+    # the app API illust objects, including multi-page and series entries
+    payload = json.loads(
+        (Path(__file__).parent / "test_pixiv_rank.json").read_text("utf-8")
+    )
+    encode = encode_json if encoder == "orjson" else encode_json_compatible
+    assert benchmark(encode, payload) == encode_json_compatible(payload)
+
+
+def test_fields_projection():
+    from fastapi import FastAPI
+
+    from hibiapi.app.handlers import exception_handler
+    from hibiapi.app.middlewares import ContextVarMiddleware
+    from hibiapi.utils.exceptions import BaseServerException
+    from hibiapi.utils.net import BaseNetClient
+    from hibiapi.utils.routing import BaseEndpoint, EndpointRouter
+
+    from .test_cache import illust_page
+
+    class ProjectionEndpoint(BaseEndpoint):
+        async def search(self, *, size: int = 30):
+            return illust_page(size)
+
+    class ProjectionNetClient(BaseNetClient):
+        pass
+
+    router = EndpointRouter()
+    router.include_endpoint(ProjectionEndpoint, ProjectionNetClient())
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_exception_handler(BaseServerException, exception_handler)  # type:ignore
+    app.add_middleware(ContextVarMiddleware)
+
+    fields = "illusts{id,title,tags{name}},next_url"
+    with TestClient(app) as client:
+        full = client.get("/search", params={"size": 2}).json()
+        for params in (
+            {"size": 2, "fields": fields},
+            {"type": "search", "size": 2, "fields": fields},
+        ):
+            response = client.get(
+                "/search" if "type" not in params else "/", params=params
+            )
+            assert response.status_code == 200
+            assert response.json() == {
+                "illusts": [
+                    {
+                        "id": illust["id"],
+                        "title": illust["title"],
+                        "tags": [{"name": tag["name"]} for tag in illust["tags"]],
+                    }
+                    for illust in full["illusts"]
+                ],
+                "next_url": full["next_url"],
+            }
+
+        # NOTE: projections are cached with their own entity tags
+        projected = client.get("/search", params={"size": 2, "fields": fields})
+        reordered = client.get(
+            "/search",
+            params={"size": 2, "fields": "next_url, illusts{tags{name},title,id}"},
+        )
+        etag = projected.headers["ETag"]
+        assert etag == reordered.headers["ETag"]
+        assert etag != client.get("/search", params={"size": 2}).headers["ETag"]
+        response = client.get(
+            "/search",
+            params={"size": 2, "fields": fields},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+
+        response = client.get("/search", params={"fields": "illusts{id"})
+        assert response.status_code == 400
+
+    from hibiapi.utils.projection import compile_fields
+
+    assert compile_fields("a{b}, a{c{d}}, e, e{f}") == {
+        "a": {"b": None, "c": {"d": None}},
+        "e": None,
+    }
+
+
+@pytest.mark.parametrize("projection", ["full", "projected", "per-request"])
+def test_projection_benchmark(benchmark: BenchmarkFixture, projection: str):
+    import asyncio
+
+    from starlette.datastructures import Headers, MutableHeaders
+
+    from hibiapi.utils.cache import CACHE_RAW_KEY, cache_config, endpoint_cache
+    from hibiapi.utils.encoding import FastJSONResponse
+    from hibiapi.utils.projection import compile_projector
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    from .test_cache import illust_page
+
+    payload = illust_page(30)
+    fields = "illusts{id,title,image_urls,tags},next_url"
+
+    @endpoint_cache
+    @cache_config(namespace=f"test_projection_benchmark_{projection}", raw=True)
+    async def search():
+        return payload
+
+    raw_search = getattr(search, CACHE_RAW_KEY)
+
+    async def serve():
+        request_headers.set(Headers())
+        response_headers.set(MutableHeaders())
+        if projection == "full":
+            return await raw_search()
+        elif projection == "projected":
+            return await raw_search(fields=fields)
+        # NOTE: projection used before projected entries were cached
+        return FastJSONResponse(compile_projector(fields)(await search()))
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(serve())
+    response = benchmark(lambda: loop.run_until_complete(serve()))
+    assert response.status_code == 200
+    loop.close()
+
+
+@pytest.mark.parametrize("middleware", ["http", "asgi"])
+def test_middleware_benchmark(benchmark: BenchmarkFixture, middleware: str):
+    import asyncio
+
+    from fastapi import FastAPI, Request
+    from httpx import ASGITransport, AsyncClient
+    from starlette.datastructures import MutableHeaders
+
+    from hibiapi.app.middlewares import (
+        ContextVarMiddleware,
+        RequestLoggerMiddleware,
+        UncaughtExceptionMiddleware,
+    )
+    from hibiapi.utils.cache import cache_config, endpoint_cache
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    app = FastAPI()
+
+    @app.get("/cached")
+    @endpoint_cache
+    @cache_config(namespace=f"test_middleware_benchmark_{middleware}")
+    async def cached():
+        return {"cached": True}
+
+    if middleware == "asgi":
+        app.add_middleware(RequestLoggerMiddleware)
+        app.add_middleware(ContextVarMiddleware)
+        app.add_middleware(UncaughtExceptionMiddleware)
+    else:
+        # NOTE: `BaseHTTPMiddleware` stack used before the ASGI middlewares
+        @app.middleware("http")
+        async def request_logger(request: Request, call_next):
+            response = await call_next(request)
+            response_headers.get().setdefault("X-Process-Time", "0.000")
+            return response
+
+        @app.middleware("http")
+        async def contextvar_setter(request: Request, call_next):
+            request_headers.set(request.headers)
+            response_headers.set(MutableHeaders())
+            response = await call_next(request)
+            response.headers.update({**response_headers.get()})
+            return response
+
+        @app.middleware("http")
+        async def uncaught_exception_handler(request: Request, call_next):
+            return await call_next(request)
+
+    loop = asyncio.new_event_loop()
+    client = AsyncClient(transport=ASGITransport(app), base_url="http://testserver")
+
+    response = loop.run_until_complete(client.get("/cached"))
+    assert response.json() == {"cached": True}
+
+    response = benchmark(lambda: loop.run_until_complete(client.get("/cached")))
+    assert response.headers["X-Cache-Status"] == "fresh"
+    assert "X-Process-Time" in response.headers
+    if benchmark.stats:
+        benchmark.extra_info["requests_per_second"] = 1 / benchmark.stats.stats.mean
+
+    loop.run_until_complete(client.aclose())
+    loop.close()
+
+
+def test_metrics(client: TestClient):
+    client.get("/docs")
+    client.get("/notexistpath")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    lines = response.text.splitlines()
+    assert "# TYPE hibiapi_route_request_seconds histogram" in lines
+    assert any(
+        line.startswith(
+            'hibiapi_route_request_seconds_count{method="GET",route="/docs",status="200"}'
+        )
+        for line in lines
+    )
+    assert any('route="unmatched",status="404"' in line for line in lines)
+
+
+def test_metrics_histogram():
+    from hibiapi.utils.metrics import Histogram, registry
+
+    histogram = Histogram(
+        "test_metrics_histogram", "Test histogram", labels=("name",), buckets=(1, 2)
+    )
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe('quote"d', value=value)
+
+    assert [*histogram.render()][2:] == [
+        'test_metrics_histogram_bucket{name="quote\\"d",le="1"} 2',
+        'test_metrics_histogram_bucket{name="quote\\"d",le="2"} 3',
+        'test_metrics_histogram_bucket{name="quote\\"d",le="+Inf"} 4',
+        'test_metrics_histogram_count{name="quote\\"d"} 4',
+        'test_metrics_histogram_sum{name="quote\\"d"} 6',
+    ]
+    with pytest.raises(ValueError):
+        Histogram("test_metrics_histogram", "Duplicated histogram")
+    registry.metrics.pop(histogram.name)
+
+
+def test_access_log(tmp_path):
+    import json
+    import threading
+
+    from hibiapi.utils.access import AccessLogger, access_dropped
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "path": "/api/test",
+        "query_string": b"id=1",
+        "headers": [(b"user-agent", b"pytest")],
+        "client": ("127.0.0.1", 12345),
+    }
+
+    access = AccessLogger(format="json", sample=0, file=tmp_path / "access.log")
+    access.emit(scope, "/api/test", 200, 1.5)
+    access.emit(scope, "/api/test", 502, 1.5)
+    access.stop()
+
+    records = [
+        json.loads(line) for line in (tmp_path / "access.log").read_text().splitlines()
+    ]
+    assert len(records) == 1
+    assert records[0]["url"] == "http://testserver/api/test?id=1"
+    assert records[0]["status"] == 502 and records[0]["user_agent"] == "pytest"
+
+    # NOTE: a thread never started leaves the queue undrained
+    access = AccessLogger(format="json", maxsize=2)
+    access.thread = threading.Thread()
+    dropped = access_dropped.values[()]
+    for _ in range(5):
+        access.emit(scope, "/api/test", 200, 1.5)
+    assert access_dropped.values[()] - dropped == 3
+
+
+def test_stack_sampler():
+    import threading
+    import time
+
+    from hibiapi.utils.profiler import StackSampler
+
+    def busy_loop(stopped: threading.Event):
+        while not stopped.is_set():
+            sum(range(1000))
+
+    stopped = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stopped,))
+    worker.start()
+    assert worker.ident is not None
+
+    sampler = StackSampler(worker.ident, interval=0.001)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    stopped.set()
+    worker.join()
+
+    assert sampler.samples > 0
+    stack, count = sampler.collapsed().splitlines()[0].rsplit(" ", 1)
+    assert "busy_loop (test.test_base:" in stack.split(";")[-1]
+    assert int(count) > 0
+
+
+def test_profiling_middleware(monkeypatch: pytest.MonkeyPatch):
+    from fastapi import FastAPI
+
+    from hibiapi.app import middlewares
+
+    monkeypatch.setattr(middlewares, "PROFILING_TOKEN", "secret")
+
+    app = FastAPI()
+    app.add_middleware(middlewares.ProfilingMiddleware)
+
+    @app.get("/slow")
+    def slow():
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        assert client.get("/slow").json() == {"ok": True}
+        assert client.get("/slow", headers={"X-Profile": "wrong"}).json()
+
+        response = client.get("/slow", headers={"X-Profile": "secret"})
+        assert response.headers["content-type"].startswith("text/plain")
+        assert response.headers["X-Profile-Status"] == "200"
+        assert int(response.headers["X-Profile-Samples"]) >= 0
@@ -0,0 +1,591 @@
+import asyncio
+import pickle
+from collections.abc import Iterator
+from typing import Any
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+from starlette.datastructures import Headers, MutableHeaders
+
+
+def run_in_request(coroutine_function, *args, **kwargs):
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    async def runner():
+        request_headers.set(Headers())
+        response_headers.set(response := MutableHeaders())
+        return await coroutine_function(*args, **kwargs), response
+
+    return asyncio.run(runner())
+
+
+def illust_page(size: int = 30) -> dict[str, Any]:
+    """Build a payload shaped like a page of Pixiv illusts"""
+    return {
+        "illusts": [
+            {
+                "id": 100000000 + index,
+                "title": f"イラスト {index}",
+                "type": "illust",
+                "image_urls": {
+                    quality: f"https://i.pximg.net/c/{quality}/img/{index}_p0.jpg"
+                    for quality in ("square_medium", "medium", "large")
+                },
+                "caption": "説明文 " * 20,
+                "user": {"id": index, "name": f"user{index}", "is_followed": False},
+                "tags": [
+                    {"name": f"タグ{tag}", "translated_name": f"tag{tag}"}
+                    for tag in range(10)
+                ],
+                "create_date": "2024-01-01T00:00:00+09:00",
+                "page_count": 1,
+                "width": 1920,
+                "height": 1080,
+                "total_view": index * 100,
+                "total_bookmarks": index * 10,
+                "is_bookmarked": False,
+            }
+            for index in range(size)
+        ],
+        "next_url": "https://app-api.pixiv.net/v1/search/illust?offset=30",
+    }
+
+
+@pytest.fixture
+def request_loop() -> Iterator[asyncio.AbstractEventLoop]:
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    request_headers.set(Headers())
+    response_headers.set(MutableHeaders())
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def test_single_flight():
+    from hibiapi.utils.cache import cache_config, endpoint_cache, single_flight
+
+    called = 0
+
+    @endpoint_cache
+    @cache_config(namespace="test_single_flight")
+    async def endpoint(*, id: int) -> dict[str, Any]:
+        nonlocal called
+        called += 1
+        await asyncio.sleep(0.1)
+        return {"id": id}
+
+    async def concurrent():
+        return await asyncio.gather(*(endpoint(id=1) for _ in range(10)))
+
+    results, _ = run_in_request(concurrent)
+    assert results == [{"id": 1}] * 10
+    assert called == 1
+    assert single_flight.executed["test_single_flight"] == 1
+    assert single_flight.coalesced["test_single_flight"] == 9
+    assert not single_flight.flights
+
+
+def test_stale_while_revalidate():
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import cache_config, endpoint_cache
+    from hibiapi.utils.exceptions import UpstreamAPIException
+    from hibiapi.utils.routing import response_headers
+
+    called, failing = 0, False
+
+    @endpoint_cache
+    @cache_config(
+        ttl=timedelta(seconds=0.2),
+        hard_ttl=timedelta(seconds=5),
+        namespace="test_stale_while_revalidate",
+    )
+    async def endpoint() -> dict[str, Any]:
+        nonlocal called
+        called += 1
+        if failing:
+            raise UpstreamAPIException
+        return {"called": called}
+
+    async def request() -> tuple[Any, str]:
+        response_headers.set(headers := MutableHeaders())
+        return await endpoint(), headers["X-Cache-Status"]
+
+    async def scenario():
+        nonlocal failing
+        results = [await request()]
+        await asyncio.sleep(0.3)
+        results.append(await request())
+        await asyncio.sleep(0.1)
+        results.append(await request())
+        await asyncio.sleep(0.3)
+        failing = True
+        results.append(await request())
+        await asyncio.sleep(0.1)
+        results.append(await request())
+        return results
+
+    results, _ = run_in_request(scenario)
+    assert results == [
+        ({"called": 1}, "miss"),
+        ({"called": 1}, "stale-while-revalidate"),
+        # NOTE: background refresh replaced the entry
+        ({"called": 2}, "fresh"),
+        ({"called": 2}, "stale-while-revalidate"),
+        # NOTE: failed refresh keeps the stale entry
+        ({"called": 2}, "stale-while-revalidate"),
+    ]
+    assert called == 4
+
+
+def test_stale_while_circuit_open():
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import cache_config, endpoint_cache
+    from hibiapi.utils.circuit import CircuitBreaker, CircuitState
+    from hibiapi.utils.routing import response_headers
+
+    called = 0
+    breaker = CircuitBreaker("test", cooldown=60)
+
+    class NetClient:
+        circuit_breaker = breaker
+
+    class Client:
+        net_client = NetClient()
+
+    class Endpoint:
+        client = Client()
+
+        @endpoint_cache
+        @cache_config(
+            ttl=timedelta(seconds=0.1),
+            hard_ttl=timedelta(seconds=5),
+            namespace="test_stale_while_circuit_open",
+        )
+        async def endpoint(self) -> dict[str, Any]:
+            nonlocal called
+            called += 1
+            return {"called": called}
+
+    async def scenario():
+        endpoint = Endpoint()
+        await endpoint.endpoint()
+        await asyncio.sleep(0.2)
+        breaker._transit(CircuitState.open)
+        response_headers.set(headers := MutableHeaders())
+        stale = await endpoint.endpoint()
+        await asyncio.sleep(0.1)
+        return stale, headers
+
+    (stale, headers), _ = run_in_request(scenario)
+    assert stale == {"called": 1}
+    assert headers["X-Cache-Status"] == "stale-while-revalidate"
+    assert called == 1
+
+
+def test_stale_if_error():
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import cache_config, endpoint_cache
+    from hibiapi.utils.exceptions import UpstreamAPIException
+
+    failing = False
+
+    @endpoint_cache
+    @cache_config(
+        ttl=timedelta(seconds=0.1),
+        grace=timedelta(seconds=5),
+        namespace="test_stale_if_error",
+    )
+    async def endpoint() -> dict[str, Any]:
+        if failing:
+            raise UpstreamAPIException
+        return {"ok": True}
+
+    assert run_in_request(endpoint)[0] == {"ok": True}
+    failing = True
+    asyncio.run(asyncio.sleep(0.2))
+
+    result, headers = run_in_request(endpoint)
+    assert result == {"ok": True}
+    assert headers["X-Cache-Status"] == "stale-if-error"
+
+
+def test_invalidation_listener_restart():
+    from contextlib import asynccontextmanager
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import CacheEntry, LocalCache, TwoTierCache, cache
+
+    local = LocalCache(max_size=1 << 20, ttl=60)
+    tiered = TwoTierCache(cache, local)
+    tiered.retry_delay = 0.01
+    connections = 0
+
+    class PubSub:
+        async def subscribe(self, channel: str):
+            if connections == 1:
+                raise ConnectionError("Connection reset by peer")
+
+        async def listen(self):
+            yield {"data": b"other:evicted"}
+            await asyncio.Event().wait()
+
+    class Redis:
+        @asynccontextmanager
+        async def pubsub(self, **kwargs):
+            nonlocal connections
+            connections += 1
+            yield PubSub()
+
+    async def scenario():
+        for key in ("evicted", "kept"):
+            local.set(key, CacheEntry(key), timedelta(hours=1))
+        tiered.redis = Redis()
+        tiered.listener = asyncio.create_task(tiered._listen())
+        await asyncio.sleep(0.1)
+        # NOTE: reconnected after the failure, dropping entries which may be stale
+        assert connections == 2
+        assert local.get("evicted") is None and local.get("kept") is None
+        await tiered.stop()
+
+    asyncio.run(scenario())
+
+
+def test_local_cache_eviction():
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import CacheEntry, LocalCache
+
+    local = LocalCache(max_size=4096, ttl=60)
+    for index in range(16):
+        local.set(f"key-{index}", CacheEntry("x" * 1024), timedelta(hours=1))
+        assert local.size <= local.max_size
+
+    assert local.get("key-0") is None
+    assert (entry := local.get("key-15")) and entry.value == "x" * 1024
+
+    local.set("expired", CacheEntry("value"), timedelta(0))
+    assert local.get("expired") is None
+
+
+def test_raw_storage():
+    from fastapi import Response
+
+    from hibiapi.utils.cache import CACHE_RAW_KEY, cache_config, endpoint_cache
+
+    @endpoint_cache
+    @cache_config(raw=True, namespace="test_raw_storage")
+    async def endpoint(*, size: int) -> dict[str, Any]:
+        return illust_page(size)
+
+    raw_endpoint = getattr(endpoint, CACHE_RAW_KEY)
+
+    assert run_in_request(endpoint, size=2)[0] == illust_page(2)
+    response, headers = run_in_request(raw_endpoint, size=2)
+    assert isinstance(response, Response)
+    assert response.media_type == "application/json"
+    assert headers["X-Cache-Status"] == "fresh"
+
+
+def test_negotiate_encoding():
+    from hibiapi.utils.compression import negotiate
+
+    available = ("zstd", "br", "gzip")
+    assert negotiate(None, available) is None
+    assert negotiate("identity", available) is None
+    assert negotiate("gzip, deflate, br, zstd", available) == "zstd"
+    assert negotiate("gzip;q=1.0, br;q=0.8", available) == "gzip"
+    assert negotiate("br;q=0, *", available) == "zstd"
+    assert negotiate("*;q=0.5, gzip", available) == "gzip"
+    assert negotiate("gzip;q=0", available) is None
+    assert negotiate("br, gzip", ("gzip",)) == "gzip"
+
+
+def test_precompressed_variants():
+    import gzip
+
+    from hibiapi.utils.cache import CACHE_RAW_KEY, cache_config, endpoint_cache
+    from hibiapi.utils.compression import COMPRESSORS, DECOMPRESSORS, ENCODINGS
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    @endpoint_cache
+    @cache_config(raw=True, namespace="test_precompressed_variants")
+    async def endpoint() -> dict[str, Any]:
+        return illust_page()
+
+    raw_endpoint = getattr(endpoint, CACHE_RAW_KEY)
+
+    async def fetch(accept_encoding: str):
+        request_headers.set(Headers({"Accept-Encoding": accept_encoding}))
+        response_headers.set(MutableHeaders())
+        return await raw_endpoint()
+
+    async def main():
+        plain = await fetch("identity")
+        assert "content-encoding" not in plain.headers
+        assert plain.headers["vary"] == "Accept-Encoding"
+
+        for encoding in ENCODINGS:
+            response = await fetch(encoding)
+            assert response.headers["content-encoding"] == encoding
+            assert DECOMPRESSORS[encoding](response.body) == plain.body
+            # NOTE: a hit serves the stored bytes instead of compressing again
+            assert response.body is (await fetch(encoding)).body
+
+    assert "gzip" in COMPRESSORS
+    asyncio.run(main())
+
+    from hibiapi.utils.cache import CacheEntry
+
+    entry = CacheEntry.new(illust_page(), raw=True, compress=True)
+    assert entry.encoding == "gzip" and "gzip" not in entry.variants
+    response = entry.response(Headers({"Accept-Encoding": "gzip"}))
+    assert gzip.decompress(response.body) == entry.content
+    assert not CacheEntry.new({"small": True}, raw=True).variants
+
+
+@pytest.mark.parametrize("raw", [False, True], ids=["object", "raw"])
+def test_conditional_requests(raw: bool):
+    from email.utils import formatdate
+
+    from hibiapi.utils.cache import CACHE_RAW_KEY, cache_config, endpoint_cache
+    from hibiapi.utils.routing import request_headers, response_headers
+
+    @endpoint_cache
+    @cache_config(raw=raw, namespace=f"test_conditional_requests_{raw}")
+    async def endpoint() -> dict[str, Any]:
+        return illust_page(2)
+
+    raw_endpoint = getattr(endpoint, CACHE_RAW_KEY)
+
+    async def fetch(**headers: str):
+        request_headers.set(Headers(headers))
+        response_headers.set(MutableHeaders())
+        return await raw_endpoint()
+
+    async def main():
+        response = await fetch()
+        assert response.status_code == 200
+        etag, last_modified = (
+            response.headers["etag"],
+            response.headers["last-modified"],
+        )
+        assert etag.startswith('"') and etag.endswith('"')
+
+        not_modified = await fetch(**{"If-None-Match": f'W/{etag}, "other"'})
+        assert not_modified.status_code == 304 and not not_modified.body
+        assert not_modified.headers["etag"] == etag
+
+        assert (await fetch(**{"If-None-Match": '"other"'})).status_code == 200
+        assert (await fetch(**{"If-Modified-Since": last_modified})).status_code == 304
+        earlier = formatdate(0, usegmt=True)
+        assert (await fetch(**{"If-Modified-Since": earlier})).status_code == 200
+        # NOTE: If-Modified-Since is ignored when If-None-Match is present
+        assert (
+            await fetch(
+                **{"If-None-Match": '"other"', "If-Modified-Since": last_modified}
+            )
+        ).status_code == 200
+        assert (await fetch(**{"If-Modified-Since": "invalid"})).status_code == 200
+
+        compressed = await fetch(**{"Accept-Encoding": "gzip"})
+        if "content-encoding" in compressed.headers:
+            assert compressed.headers["etag"] != etag
+            matched = await fetch(
+                **{
+                    "Accept-Encoding": "gzip",
+                    "If-None-Match": compressed.headers["etag"],
+                }
+            )
+            assert matched.status_code == 304
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("raw", [False, True], ids=["object", "raw"])
+def test_cache_hit_benchmark(
+    request_loop: asyncio.AbstractEventLoop, benchmark: BenchmarkFixture, raw: bool
+):
+    from fastapi.responses import JSONResponse
+
+    from hibiapi.utils.cache import (
+        CACHE_RAW_KEY,
+        CacheEntry,
+        cache_config,
+        endpoint_cache,
+    )
+
+    @endpoint_cache
+    @cache_config(raw=raw, namespace=f"test_cache_hit_benchmark_{raw}")
+    async def endpoint() -> dict[str, Any]:
+        return illust_page()
+
+    raw_endpoint = getattr(endpoint, CACHE_RAW_KEY)
+
+    async def hit():
+        if raw:
+            return await raw_endpoint()
+        # NOTE: object entries are encoded by FastAPI after being returned
+        return JSONResponse(await endpoint())
+
+    benchmark.extra_info["entry_size"] = len(
+        pickle.dumps(CacheEntry.new(illust_page(), raw=raw, compress=False))
+    )
+    benchmark.extra_info["compressed_size"] = len(
+        pickle.dumps(CacheEntry.new(illust_page(), raw=raw, compress=True))
+    )
+
+    miss = request_loop.run_until_complete(hit())
+    hit_response = benchmark(lambda: request_loop.run_until_complete(hit()))
+    assert hit_response.body == miss.body
+
+
+def test_cache_key_builder():
+    from enum import Enum
+
+    from hibiapi.utils.cache import CacheKeyBuilder
+
+    class Mode(str, Enum):
+        day = "day"
+
+    class Endpoint:
+        async def rank(self, *, mode: Mode = Mode.day, page: int = 1):
+            return {}
+
+    build_key = CacheKeyBuilder(Endpoint.rank, "rank")
+    key = build_key((Endpoint(),), {})
+
+    assert key.startswith("rank:") and len(key) == len("rank:") + 32
+    assert key == build_key((Endpoint(),), {"mode": "day", "page": 1})
+    assert key != build_key((Endpoint(),), {"page": 2})
+    # NOTE: raw query strings share the key with validated arguments
+    assert key == build_key((Endpoint(),), {"mode": "day", "page": "1"})
+    assert build_key((Endpoint(),), {"page": "2"}) == build_key(
+        (Endpoint(),), {"page": 2}
+    )
+
+
+@pytest.mark.parametrize("builder", ["model", "canonical"])
+def test_cache_key_benchmark(benchmark: BenchmarkFixture, builder: str):
+    import hashlib
+    from datetime import date
+    from enum import Enum
+    from typing import Optional
+
+    from pydantic.decorator import ValidatedFunction
+
+    from hibiapi.utils.cache import CacheKeyBuilder
+
+    class Mode(str, Enum):
+        week = "week"
+
+    async def rank(
+        self, *, mode: Mode = Mode.week, date: Optional[date] = None, page: int = 1
+    ):
+        return {}
+
+    args, kwargs = (object(),), {"mode": Mode.week, "date": None, "page": 1}
+
+    if builder == "canonical":
+        build_key = CacheKeyBuilder(rank, "rank")
+    else:
+        vf = ValidatedFunction(rank, config={})
+
+        # NOTE: key derivation used before `CacheKeyBuilder` was introduced
+        def build_key(args, kwargs):
+            model = vf.model(**vf.build_values(args=args, kwargs=kwargs))
+            return (
+                "rank:"
+                + hashlib.md5(
+                    model.json(exclude={"self"}, sort_keys=True).encode()
+                ).hexdigest()
+            )
+
+    assert benchmark(build_key, args, kwargs).startswith("rank:")
+
+
+def test_warmup_scheduler():
+    from datetime import timedelta
+
+    from hibiapi.utils.cache import cache_config
+    from hibiapi.utils.config import APIConfig
+    from hibiapi.utils.net import BaseNetClient
+    from hibiapi.utils.routing import BaseEndpoint
+    from hibiapi.utils.warmup import WarmupScheduler
+
+    called: list[int] = []
+
+    class WarmupEndpoint(BaseEndpoint, cache_endpoints=True):
+        @cache_config(ttl=timedelta(hours=1), namespace="test_warmup_scheduler")
+        async def hot(self, *, id: int):
+            called.append(id)
+            return {"id": id}
+
+    scheduler = WarmupScheduler(concurrency=1, interval=timedelta(minutes=10))
+    scheduler.register(
+        APIConfig("wallpaper"),
+        WarmupEndpoint,
+        BaseNetClient(),
+        "hot",
+        lambda: ({"id": id} for id in range(3)),
+    )
+
+    async def warmup():
+        scheduler.semaphore = asyncio.Semaphore(scheduler.concurrency)
+        await scheduler.run(*scheduler.jobs)
+        await scheduler.run(*scheduler.jobs)
+
+    asyncio.run(warmup())
+    assert sorted(called) == [0, 1, 2]
+
+
+def test_tracing_spans():
+    from httpx import MockTransport, Response
+
+    from hibiapi.utils.cache import cache_config, endpoint_cache
+    from hibiapi.utils.net import BaseNetClient
+    from hibiapi.utils.tracing import Tracer, current_span
+
+    tracer = Tracer(enabled=True, sample=1, buffer=1)
+    net_client = BaseNetClient()
+    assert net_client.client is not None
+    net_client.client._transport = MockTransport(lambda _: Response(200, json={}))
+
+    @endpoint_cache
+    @cache_config(namespace="test_tracing_spans")
+    async def endpoint() -> dict[str, Any]:
+        async with net_client as client:
+            return (await client.get("http://upstream.test/path?query=1")).json()
+
+    async def traced():
+        root = tracer.start("GET /test")
+        assert root is not None
+        token = current_span.set(root)
+        try:
+            await endpoint()
+        finally:
+            current_span.reset(token)
+            tracer.finish(root)
+
+    run_in_request(traced)
+    (trace,) = tracer.recent()
+    spans = {span.name: span for span in trace.spans}
+
+    assert [*spans] == [
+        "GET /test",
+        "cache.key",
+        "cache.get",
+        "cache.fetch",
+        "upstream.request",
+        "upstream.attempt",
+        "cache.set",
+        "cache.load",
+    ]
+    assert spans["cache.get"].attributes["hit"] is False
+    assert spans["upstream.request"].parent_id == spans["cache.fetch"].span_id
+    assert spans["upstream.request"].attributes["url"] == "http://upstream.test/path"
+    assert all(span.duration is not None for span in trace.spans)
+    assert Tracer(enabled=True, sample=0).start("GET /test") is None
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+
+def test_token_bucket():
+    from hibiapi.utils.limiter import RateLimit, TokenBucket
+
+    bucket = TokenBucket(RateLimit(max=3, interval=3), tokens=3, updated=0)
+
+    assert [bucket.acquire(now=0) for _ in range(3)] == [None] * 3
+    assert bucket.acquire(now=0) == pytest.approx(1)
+    assert bucket.acquire(now=0.5) == pytest.approx(0.5)
+    assert bucket.acquire(now=1) is None
+
+    # NOTE: refill is capped, so there is no burst at window edges
+    bucket.refill(now=100)
+    assert bucket.tokens == 3
+
+
+def test_limit_resolve():
+    from hibiapi.utils.limiter import RateLimit, RateLimiter
+
+    default, pixiv, admin = (
+        RateLimit(max=60, interval=60),
+        RateLimit(max=10, interval=60),
+        RateLimit(max=600, interval=60),
+    )
+    limiter = RateLimiter(
+        default,
+        routes={"/api": default, "/api/pixiv": pixiv},
+        credentials={"admin": admin},
+    )
+
+    assert limiter.resolve("/api/pixiv/rank", "ip") == (
+        "rate_limit:/api/pixiv:ip",
+        pixiv,
+    )
+    assert limiter.resolve("/api/bika/search", "ip") == ("rate_limit:/api:ip", default)
+    assert limiter.resolve("/docs", "ip", "guest") == (
+        "rate_limit::credential-guest",
+        default,
+    )
+    assert limiter.resolve("/api/pixiv/rank", "ip", "admin")[1] == admin
+
+
+def test_limit_reconcile(monkeypatch: pytest.MonkeyPatch):
+    from hibiapi.utils import limiter as limiter_module
+    from hibiapi.utils.limiter import RateLimit, RateLimiter
+
+    # NOTE: both limiters share the in-memory cache, acting as two workers
+    monkeypatch.setattr(limiter_module, "CACHE_SHARED", True)
+    limit = RateLimit(max=10, interval=3600)
+    first, second = RateLimiter(limit), RateLimiter(limit)
+
+    async def scenario():
+        assert await second.acquire("rate_limit:reconcile", limit) is None
+        for _ in range(6):
+            assert await first.acquire("rate_limit:reconcile", limit) is None
+        await first.reconcile()
+        await second.reconcile()
+
+        allowed = 0
+        while await second.acquire("rate_limit:reconcile", limit) is None:
+            allowed += 1
+        return allowed
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_limit_prune_local(monkeypatch: pytest.MonkeyPatch):
+    from hibiapi.utils import limiter as limiter_module
+    from hibiapi.utils.limiter import RateLimit, RateLimiter
+
+    monkeypatch.setattr(limiter_module, "CACHE_SHARED", False)
+    limit = RateLimit(max=10, interval=0.1)
+    limiter = RateLimiter(limit)
+
+    async def scenario():
+        for index in range(1000):
+            assert await limiter.acquire(f"rate_limit:prune:{index}", limit) is None
+        await limiter.reconcile()
+        assert len(limiter.buckets) == 1000
+        # NOTE: buckets are dropped once refilled
+        await asyncio.sleep(0.2)
+        await limiter.reconcile()
+        return len(limiter.buckets)
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,424 @@
+import asyncio
+import time
+
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+from pytest_httpserver import HTTPServer
+
+
+def test_pool_config(httpserver: HTTPServer):
+    from hibiapi.utils.net import BaseNetClient, PoolConfig
+
+    class PoolNetClient(BaseNetClient):
+        pass
+
+    httpserver.expect_request("/").respond_with_json({"ok": True})
+
+    pool = PoolConfig.parse_obj({"max-connections": 1, "timeout": {"pool": 1}})
+    net_client = PoolNetClient(pool=pool)
+
+    async def request():
+        async with net_client as client:
+            responses = await asyncio.gather(
+                *(client.get(httpserver.url_for("/")) for _ in range(3))
+            )
+        return [response.json() for response in responses]
+
+    assert asyncio.run(request()) == [{"ok": True}] * 3
+    assert PoolNetClient.pool_statistics.waits == 3
+    assert PoolNetClient.pool_statistics is not BaseNetClient.pool_statistics
+
+
+def test_pool_trace_chained():
+    from httpx import MockTransport, Request, Response
+
+    from hibiapi.utils.net import AsyncHTTPClient, BaseNetClient, PoolStatistics
+
+    class TracedNetClient(BaseNetClient):
+        pool_statistics = PoolStatistics(enabled=True)
+
+    events: list[str] = []
+
+    async def trace(event_name: str, info: dict):
+        events.append(event_name)
+
+    async def handler(request: Request):
+        # NOTE: emitted by httpcore once a connection is acquired
+        await request.extensions["trace"]("http11.send_request_headers.started", {})
+        return Response(200)
+
+    async def request():
+        async with AsyncHTTPClient(transport=MockTransport(handler)) as client:
+            client.net_client = TracedNetClient()
+            request = client.build_request("GET", "http://testserver/")
+            request.extensions["trace"] = trace
+            return await client.send(request)
+
+    assert asyncio.run(request()).status_code == 200
+    assert events == ["http11.send_request_headers.started"]
+    assert TracedNetClient.pool_statistics.waits == 1
+
+
+@pytest.mark.parametrize("client_type", ["legacy", "pipeline"])
+def test_client_overhead_benchmark(benchmark: BenchmarkFixture, client_type: str):
+    from httpx import MockTransport, Request, Response, ResponseNotRead
+
+    from hibiapi.utils.log import logger
+    from hibiapi.utils.net import AsyncHTTPClient, BaseNetClient, PoolStatistics
+
+    class BenchmarkNetClient(BaseNetClient):
+        pool_statistics = PoolStatistics(enabled=False)
+
+    # NOTE: instrumentation used before hooks were registered once, the rest
+    # of the request pipeline is shared so that only the hooks are compared
+    class LegacyClient(AsyncHTTPClient):
+        @classmethod
+        def _default_event_hooks(cls):
+            return {}
+
+        @staticmethod
+        async def _log_request(request: Request):
+            method, url = request.method, request.url
+            logger.debug(f"Network request sent: {method} {url}")
+
+        @staticmethod
+        async def _log_response(response: Response):
+            method, url = response.request.method, response.url
+            try:
+                length, code = len(response.content), response.status_code
+            except ResponseNotRead:
+                length, code = -1, response.status_code
+            logger.debug(f"Network request finished: {method} {url} {code} {length}")
+
+        async def send(self, request: Request, **kwargs):
+            self.event_hooks = {
+                "request": [self._log_request],
+                "response": [self._log_response],
+            }
+            return await super().send(request, **kwargs)
+
+    transport = MockTransport(lambda request: Response(200, json={"ok": True}))
+    client_class = LegacyClient if client_type == "legacy" else AsyncHTTPClient
+    client = client_class(transport=transport)
+    client.net_client = BenchmarkNetClient()
+
+    loop = asyncio.new_event_loop()
+    response = benchmark(
+        lambda: loop.run_until_complete(client.get("http://testserver/"))
+    )
+    assert response.json() == {"ok": True}
+    loop.run_until_complete(client.aclose())
+    loop.close()
+
+
+def test_retry_status(httpserver: HTTPServer):
+    from hibiapi.utils.net import BaseNetClient
+
+    class RetryNetClient(BaseNetClient):
+        pass
+
+    httpserver.expect_ordered_request("/").respond_with_data(
+        status=503, headers={"Retry-After": "0"}
+    )
+    httpserver.expect_ordered_request("/").respond_with_json({"ok": True})
+    httpserver.expect_ordered_request("/", method="POST").respond_with_data(status=503)
+
+    async def request():
+        async with RetryNetClient() as client:
+            retried = await client.get(httpserver.url_for("/"))
+            not_idempotent = await client.post(httpserver.url_for("/"))
+        return retried, not_idempotent
+
+    retried, not_idempotent = asyncio.run(request())
+    assert retried.json() == {"ok": True}
+    assert not_idempotent.status_code == 503
+    assert RetryNetClient.retry_budget.retries == 1
+
+
+def test_retry_budget():
+    from hibiapi.utils.decorators import Retry, RetryBudget
+
+    budget, called = RetryBudget(ratio=0.5, capacity=1), 0
+
+    @Retry(retries=3, delay=0, budget=lambda: budget)
+    def always_fail():
+        nonlocal called
+        called += 1
+        raise ValueError
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            always_fail()
+
+    # NOTE: only the burst token is available, deposits are capped by capacity
+    assert budget.retries == 1 and budget.exhausted == 2
+    assert called == 3
+
+
+def test_circuit_breaker():
+    from hibiapi.utils.circuit import CircuitBreaker, CircuitOpenError, CircuitState
+
+    breaker = CircuitBreaker(
+        "test", window=60, minimum=4, error_ratio=0.5, slow=1, cooldown=0, probes=2
+    )
+
+    for failed in (False, True, False):
+        breaker.release(breaker.acquire(), failed, elapsed=0.1)
+    assert breaker.state is CircuitState.closed
+
+    breaker.release(breaker.acquire(), None, elapsed=0.1)
+    before = breaker.acquire()
+    breaker.release(breaker.acquire(), True, elapsed=0.1)
+    assert breaker.state is CircuitState.open
+
+    # NOTE: cooldown is over immediately, so only `probes` requests pass
+    first, second = breaker.acquire(), breaker.acquire()
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    assert breaker.state is CircuitState.half_open
+
+    # NOTE: requests acquired while closed are not probes
+    breaker.release(before, False, elapsed=0.1)
+    assert breaker.probing == 2
+
+    breaker.release(first, False, elapsed=0.1)
+    breaker.release(second, False, elapsed=0.1)
+    assert breaker.status().state is CircuitState.closed
+    assert breaker.status().requests == 0
+
+
+def test_circuit_open_fallback(httpserver: HTTPServer):
+    from hibiapi.utils.circuit import CircuitBreaker, CircuitState
+    from hibiapi.utils.exceptions import UpstreamAPIException
+    from hibiapi.utils.net import BaseNetClient, catch_network_error
+
+    class CircuitNetClient(BaseNetClient):
+        circuit_breaker = CircuitBreaker("test", minimum=1, cooldown=60)
+
+    httpserver.expect_request("/", method="POST").respond_with_data(status=500)
+
+    @catch_network_error
+    async def request():
+        async with CircuitNetClient() as client:
+            return await client.post(httpserver.url_for("/"))
+
+    assert asyncio.run(request()).status_code == 500
+    assert CircuitNetClient.circuit_breaker.state is CircuitState.open
+
+    with pytest.raises(UpstreamAPIException) as exc_info:
+        asyncio.run(request())
+    assert exc_info.value.data.code == 503
+    assert exc_info.value.data.headers["Retry-After"] == "60"
+
+
+def test_timing_registry():
+    from hibiapi.utils.decorators.timer import TimingRegistry
+
+    registry = TimingRegistry(enabled=True, register=False)
+
+    @registry.timed
+    def sleep(seconds: float):
+        time.sleep(seconds)
+
+    for seconds in (0, 0, 0, 0.01):
+        sleep(seconds)
+
+    summary = registry.summary()[f"{__name__}.{sleep.__qualname__}"]
+    assert summary["count"] == 4
+    assert summary["p50"] < 0.001 <= 0.01 <= summary["p99"] == summary["max"]
+    assert 'function_seconds_bucket{function="' in "\n".join(registry.render())
+
+    def function():
+        pass
+
+    assert TimingRegistry(enabled=False, register=False).timed(function) is function
+
+
+@pytest.mark.parametrize("enabled", [False, True], ids=["disabled", "enabled"])
+def test_timing_overhead_benchmark(benchmark: BenchmarkFixture, enabled: bool):
+    from hibiapi.utils.decorators.timer import TimingRegistry
+
+    registry = TimingRegistry(enabled=enabled, register=False)
+
+    @registry.timed
+    def function():
+        pass
+
+    benchmark(function)
+
+
+def test_loop_watchdog(monkeypatch: pytest.MonkeyPatch):
+    from hibiapi.utils import watchdog as watchdog_module
+    from hibiapi.utils.watchdog import LoopWatchdog, loop_blocked
+
+    def blocking_call():
+        time.sleep(0.3)
+
+    async def scenario():
+        watchdog = LoopWatchdog(interval=0.02, threshold=0.1)
+        await watchdog.start()
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        await watchdog.stop()
+        return watchdog
+
+    monkeypatch.setattr(watchdog_module, "WATCHDOG_ENABLED", True)
+    blocked = loop_blocked.values[()]
+    watchdog = asyncio.run(scenario())
+
+    (blocking,) = watchdog.blocking_calls
+    assert "blocking_call (test.test_net:" in blocking.stack.split(";")[-1]
+    assert blocking.blocked >= 0.1
+    assert loop_blocked.values[()] - blocked == 1
+
+
+def test_pixiv_token_refresh(httpserver: HTTPServer, monkeypatch: pytest.MonkeyPatch):
+    from datetime import timedelta
+
+    from hibiapi.api.pixiv import net as pixiv_net
+    from hibiapi.api.pixiv.constants import PixivConstants
+    from hibiapi.api.pixiv.net import NetRequest
+    from hibiapi.utils.credentials import CredentialStore
+
+    monkeypatch.setattr(PixivConstants, "AUTH_HOST", httpserver.url_for("/"))
+    monkeypatch.setattr(pixiv_net, "credentials", CredentialStore(enabled=False))
+    httpserver.expect_request("/auth/token", method="POST").respond_with_json(
+        {
+            "expires_in": 3600,
+            "access_token": "access",
+            "refresh_token": "token",
+            "user": {
+                "account": "account",
+                "id": 1,
+                "is_premium": False,
+                "mail_address": "mail@example.com",
+                "name": "name",
+            },
+        }
+    )
+
+    net_client = NetRequest(["token"])
+    # NOTE: refresh in background shortly after every refresh
+    net_client.refresh_ahead = timedelta(seconds=3600 - 0.2)
+
+    async def main():
+        assert net_client.valid_auth("token") is None
+        results = await asyncio.gather(
+            *(net_client.refresh("token") for _ in range(10))
+        )
+        assert len(httpserver.log) == 1
+        assert all(result is results[0] for result in results)
+
+        auth = net_client.valid_auth("token")
+        assert auth is results[0] and auth.valid
+
+        await asyncio.sleep(0.5)
+        assert len(httpserver.log) >= 2
+        assert net_client.valid_auth("token") is not results[0]
+
+    asyncio.run(main())
+
+
+def test_account_scheduler():
+    from hibiapi.api.pixiv.net import AccountScheduler
+
+    scheduler = AccountScheduler(
+        ["a", "b", "c"], rate=20, window=10, throttle_ratio=0.5, quarantine=60
+    )
+    a, b, c = scheduler.accounts
+
+    async def main():
+        # NOTE: concurrent requests are spread over idle accounts first
+        first = await asyncio.gather(*(scheduler.acquire() for _ in range(3)))
+        assert {account.token for account in first} == {"a", "b", "c"}
+        for account in first:
+            scheduler.release(account, 0.1 if account is a else 0.5, False)
+
+        # NOTE: then paced, a fourth request waits for the next slot
+        started = time.perf_counter()
+        await asyncio.gather(*(scheduler.acquire() for _ in range(4)))
+        assert time.perf_counter() - started >= 0.04
+        assert (a.in_flight, b.in_flight, c.in_flight) == (2, 1, 1)
+
+        for _ in range(scheduler.minimum):
+            b.in_flight += 1
+            scheduler.release(b, 0.1, True)
+        assert b.quarantined_until > time.monotonic()
+        await asyncio.sleep(0.1)
+        picked = [await scheduler.acquire() for _ in range(4)]
+        assert b not in picked
+
+    asyncio.run(main())
+
+    from hibiapi.utils.exceptions import UpstreamAPIException
+
+    paced = AccountScheduler(["a"], rate=1, max_wait=1.5)
+    (account,) = paced.accounts
+
+    async def queued():
+        await paced.acquire()
+        waiting = asyncio.ensure_future(paced.acquire())
+        await asyncio.sleep(0)
+        slot = account.next_slot
+
+        # NOTE: the third request would wait about 2 seconds
+        with pytest.raises(UpstreamAPIException) as exc_info:
+            await paced.acquire()
+        assert exc_info.value.data.code == 503
+        assert exc_info.value.data.headers["Retry-After"] == "2"
+
+        # NOTE: a cancelled waiter gives its reserved slot back
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert account.next_slot == slot - 1
+        assert account.in_flight == 1
+
+    asyncio.run(queued())
+
+
+def test_shared_credentials(
+    httpserver: HTTPServer, monkeypatch: pytest.MonkeyPatch, tmp_path
+):
+    from hibiapi.api.pixiv import net as pixiv_net
+    from hibiapi.api.pixiv.constants import PixivConstants
+    from hibiapi.utils.credentials import CredentialStore
+
+    def auth_response(request):
+        from werkzeug import Response
+
+        # NOTE: slow enough for the other worker to wait on the lock
+        time.sleep(0.2)
+        return Response(
+            '{"expires_in": 3600, "access_token": "access", "refresh_token": "token",'
+            ' "user": {"account": "account", "id": 1, "is_premium": false,'
+            ' "mail_address": "mail@example.com", "name": "name"}}',
+            content_type="application/json",
+        )
+
+    monkeypatch.setattr(PixivConstants, "AUTH_HOST", httpserver.url_for("/"))
+    httpserver.expect_request("/auth/token", method="POST").respond_with_handler(
+        auth_response
+    )
+
+    file = tmp_path / "credentials.json"
+    monkeypatch.setattr(
+        pixiv_net, "credentials", CredentialStore(True, file, shared=False)
+    )
+    # NOTE: net clients of different workers only share the credential file
+    workers = [pixiv_net.NetRequest(["token"]) for _ in range(2)]
+
+    async def login(worker: pixiv_net.NetRequest):
+        return await worker.refresh("token")
+
+    async def main():
+        first, second = await asyncio.gather(*map(login, workers))
+        assert first.access_token == second.access_token == "access"
+
+    asyncio.run(main())
+    assert len(httpserver.log) == 1
+    assert file.exists() and oct(file.stat().st_mode & 0o777) == "0o600"
+
+    # NOTE: a restarted worker reuses the stored token as well
+    asyncio.run(login(pixiv_net.NetRequest(["token"])))
+    assert len(httpserver.log) == 1